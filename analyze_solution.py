@@ -1,4 +1,4 @@
-import pickle
+import genome_format
 from body_parts import *
 
 import sys
@@ -6,5 +6,4 @@ import sys
 genome_file = sys.argv[1]
 print(genome_file)
 
-with open(genome_file, "rb") as file:
-    print(pickle.load(file))
\ No newline at end of file
+print(genome_format.load_genome(genome_file))
@@ -0,0 +1,347 @@
+import argparse
+import copy
+import os
+import pickle
+import tempfile
+from timeit import default_timer as timer
+import tracemalloc
+import multiprocessing as mp
+
+import numpy as np
+
+import world
+from simulation import Simulation
+from solution import Solution, simulate_solutions
+from body_parts import *
+from body_compiler import compile_body, clear_subtree_cache
+from body_validator import validate_body_plan
+from body_builder import describe_body, create_brain
+from body_mutator import run_mutator, BASE_BODYPLAN, BASE_BODYCONS_ID
+from faery_pc1mp import breed_child, run_simulation_tasks
+from fitness_cache import genome_hash
+from cost_model import CostModel, body_features, FEATURE_NAMES
+from genome_archive import GenomeArchive, GenomeArchiveWriter, index_file_name
+from solution_ids import pack_solution_id
+import merge_sort
+import selection
+import constants as Cnsts
+
+
+def benchmark_batching(number_of_robots, robots_per_world_options):
+    # single-core throughput of evaluating the same robots with K robots per physics world
+    world.start_shared_world()
+
+    solutions = [Solution(solution_id=str(robot_num)) for robot_num in range(number_of_robots)]
+
+    for robots_per_world in robots_per_world_options:
+        start_time = timer()
+
+        for start in range(0, number_of_robots, robots_per_world):
+            simulate_solutions(solutions[start:start + robots_per_world])
+
+        elapsed_time = timer() - start_time
+        print('K = {:3d}: {:8.3f} seconds, {:8.3f} robots/second'.format(robots_per_world, elapsed_time, number_of_robots / elapsed_time))
+
+def rank_correlation(values1, values2):
+    ranks1 = np.argsort(np.argsort(values1))
+    ranks2 = np.argsort(np.argsort(values2))
+    return float(np.corrcoef(ranks1, ranks2)[0, 1])
+
+def benchmark_control_period(number_of_robots, control_periods):
+    # fitness-fidelity report: the same bodies and brains simulated at each control period,
+    # compared against the first period given
+    world.start_shared_world()
+
+    solutions = [Solution(solution_id=str(robot_num)) for robot_num in range(number_of_robots)]
+    for solution in solutions:
+        solution.generate_body()
+        solution.generate_brain()
+
+    fitnesses = {}
+    elapsed_times = {}
+    for control_period in control_periods:
+        start_time = timer()
+        period_fitnesses = []
+        for solution in solutions:
+            simulation = Simulation("DIRECT", solution.solution_id, solution.body, solution.weight_matrix)
+            simulation.run(control_period=control_period)
+            period_fitnesses.append(simulation.get_fitness())
+            del simulation
+        elapsed_times[control_period] = timer() - start_time
+        fitnesses[control_period] = np.array(period_fitnesses)
+
+    reference = control_periods[0]
+    print('{:>6} {:>10} {:>8} {:>14} {:>14} {:>10}'.format('k', 'seconds', 'speedup', 'mean fitness', 'mean |diff|', 'rank corr'))
+    for control_period in control_periods:
+        print('{:6d} {:10.3f} {:8.2f} {:14.4f} {:14.4f} {:10.3f}'.format(
+            control_period,
+            elapsed_times[control_period],
+            elapsed_times[reference] / elapsed_times[control_period],
+            np.mean(fitnesses[control_period]),
+            np.mean(np.abs(fitnesses[control_period] - fitnesses[reference])),
+            rank_correlation(fitnesses[control_period], fitnesses[reference])))
+
+def chain_body_plan(number_of_parts):
+    # one part per BodyCons, each growing off the previous one, alternating FRONT and TOP so the chain never folds back on itself
+    directions = (CubeElement.FRONT, CubeElement.TOP)
+    body_part = RandomSizeSensorPiece()
+    body_plan = None
+    for body_cons_id in reversed(range(number_of_parts)):
+        direction = directions[body_cons_id % 2]
+        next_body_plans = None if body_plan is None else {directions[(body_cons_id + 1) % 2]: body_plan}
+        body_plan = BodyCons(body_cons_id, body_part, [BuildSpecifications(direction, 1, Axes.Y)], next_body_plans, body_part.sample_size())
+    return body_plan
+
+def benchmark_compiler(part_counts, repeats):
+    # time to compile a body plan into its part table from scratch, to recompile it, and to compile a
+    # child whose root was mutated (every other subtree shared), and to validate it, as the plan grows;
+    # plus pickling and hashing it, which every pool task and cache lookup does, at the same depth
+    print('{:>8} {:>12} {:>12} {:>12} {:>14} {:>12} {:>12}'.format('parts', 'cold (ms)', 'warm (ms)', 'child (ms)', 'validate (ms)', 'pickle (ms)', 'hash (ms)'))
+    for number_of_parts in part_counts:
+        body_plan = chain_body_plan(number_of_parts)
+        child_plans = [BodyCons(number_of_parts + repeat, body_plan.body_part, [BuildSpecifications(CubeElement.FRONT, 2, Axes.X)], body_plan.next_body_plans, body_plan.dimensions) for repeat in range(repeats)]
+
+        cold_time = 0.0
+        for repeat in range(repeats):
+            clear_subtree_cache()
+            start_time = timer()
+            compile_body(body_plan)
+            cold_time += (timer() - start_time) / repeats
+
+        start_time = timer()
+        for repeat in range(repeats):
+            compile_body(body_plan)
+        warm_time = (timer() - start_time) / repeats
+
+        start_time = timer()
+        for child_plan in child_plans:
+            compile_body(child_plan)
+        child_time = (timer() - start_time) / repeats
+
+        start_time = timer()
+        for repeat in range(repeats):
+            validate_body_plan(body_plan)
+        validate_time = (timer() - start_time) / repeats
+
+        start_time = timer()
+        for repeat in range(repeats):
+            pickle.loads(pickle.dumps(body_plan, pickle.HIGHEST_PROTOCOL))
+        pickle_time = (timer() - start_time) / repeats
+
+        start_time = timer()
+        for repeat in range(repeats):
+            genome_hash(Genome(number_of_parts, None, body_plan))
+        hash_time = (timer() - start_time) / repeats
+
+        print('{:8d} {:12.3f} {:12.3f} {:12.3f} {:14.3f} {:12.3f} {:12.3f}'.format(number_of_parts, 1000 * cold_time, 1000 * warm_time, 1000 * child_time, 1000 * validate_time, 1000 * pickle_time, 1000 * hash_time))
+
+def benchmark_reproduction(number_of_parents, number_of_children, mutations_per_genome):
+    # memory held by, and time to breed, a generation of children from large parents, copying each
+    # parent genome first as reproduction used to, and sharing it with the children
+    parent_genomes = []
+    for parent_num in range(number_of_parents):
+        body_plan = run_mutator(BASE_BODYPLAN, BASE_BODYCONS_ID, mutations_per_genome)
+        body = describe_body(body_plan)
+        parent_genomes.append(Genome(BASE_BODYCONS_ID + mutations_per_genome, create_brain(body.joint_names, body.sensor_parts), body_plan))
+    print('mean parts per genome: {:.1f}'.format(np.mean([len(describe_body(genome.body_chromosome).part_names) for genome in parent_genomes])))
+
+    print('{:>10} {:>12} {:>16} {:>16}'.format('genomes', 'seconds', 'held (MiB)', 'peak (MiB)'))
+    for mode in ('deepcopy', 'shared'):
+        clear_subtree_cache()
+        tracemalloc.start()
+        start_time = timer()
+
+        children = []
+        for parent_num, parent_genome in enumerate(parent_genomes):
+            for child_num in range(number_of_children):
+                seed_sequence = np.random.SeedSequence(0, spawn_key=(parent_num, child_num))
+                children.append(breed_child(child_num, copy.deepcopy(parent_genome) if mode == 'deepcopy' else parent_genome, seed_sequence))
+
+        elapsed_time = timer() - start_time
+        clear_subtree_cache()
+        held_memory, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del children
+
+        print('{:>10} {:12.3f} {:16.2f} {:16.2f}'.format(mode, elapsed_time, held_memory / 2**20, peak_memory / 2**20))
+
+def benchmark_scheduling(number_of_robots, repeats):
+    # generation makespan with fixed chunks in arbitrary order against longest-first dispatch of
+    # single tasks, with the cost model fitted on the timings of the first run
+    solutions = [Solution(solution_id=str(robot_num)) for robot_num in range(number_of_robots)]
+    tasks = [(solution.solution_id, solution.genome) for solution in solutions]
+    features = np.array([body_features(genome.body_chromosome) for solution_id, genome in tasks])
+    cost_model = CostModel()
+
+    with mp.Pool(mp.cpu_count(), initializer=world.start_shared_world) as pool:
+        print('{:>14} {:>12}'.format('schedule', 'makespan (s)'))
+        for repeat in range(repeats):
+            start_time = timer()
+            chunks = [tasks[start:start + mp.cpu_count()] for start in range(0, len(tasks), mp.cpu_count())]
+            results = [result for chunk_results in pool.map(run_simulation_tasks, chunks, chunksize=1) for result in chunk_results]
+            print('{:>14} {:12.3f}'.format('chunked', timer() - start_time))
+
+            for result, task_features in zip(results, features):
+                cost_model.observe(task_features, result.elapsed, result.steps_run)
+            cost_model.fit()
+
+            start_time = timer()
+            order = cost_model.longest_first(features)
+            list(pool.imap_unordered(run_simulation_tasks, [[tasks[index]] for index in order], chunksize=1))
+            print('{:>14} {:12.3f}'.format('longest-first', timer() - start_time))
+
+    print('cost model per step: ' + ', '.join('{} {:.3g}'.format(name, coefficient) for name, coefficient in zip(FEATURE_NAMES, cost_model.coefficients)))
+
+def benchmark_lineage(number_of_parents, generations, mutations_per_genome, mutation_rates):
+    # archive size and write and read time for lineages of large genomes, each child stored whole
+    # and as a delta against its parent, with the brain rebuilt for the child's body as evaluation does
+    print('{:>6} {:>8} {:>14} {:>12} {:>12} {:>18}'.format('rate', 'mode', 'bytes/genome', 'write (s)', 'read (s)', 'rows decoded/read'))
+    for mutation_rate in mutation_rates:
+        Cnsts.mutation_rate = mutation_rate
+        lineages = []
+        for parent_num in range(number_of_parents):
+            body_plan = run_mutator(BASE_BODYPLAN, BASE_BODYCONS_ID, mutations_per_genome)
+            body = describe_body(body_plan)
+            parent_id = pack_solution_id(0, parent_num, parent_num, 0)
+            lineage = [Solution(parent_id, Genome(BASE_BODYCONS_ID + mutations_per_genome, create_brain(body.joint_names, body.sensor_parts), body_plan))]
+            for generation in range(1, generations + 1):
+                seed_sequence = np.random.SeedSequence(0, spawn_key=(parent_num, generation))
+                child_id, child_genome = breed_child(pack_solution_id(generation, parent_num, parent_num, 0), lineage[-1].genome, seed_sequence)
+                body = describe_body(child_genome.body_chromosome)
+                brain = create_brain(body.joint_names, body.sensor_parts, child_genome.brain_chromosome)
+                lineage.append(Solution(child_id, Genome(child_genome.bodycons_id, brain, child_genome.body_chromosome)))
+            for solution in lineage:
+                solution.set_fitness(0.0)
+            lineages.append(lineage)
+
+        for mode in ('whole', 'delta'):
+            archive_file = os.path.join(tempfile.mkdtemp(), 'archive.prif')
+            writer = GenomeArchiveWriter(archive_file)
+            start_time = timer()
+            for generation in range(generations + 1):
+                solutions = { lineage[generation].solution_id: lineage[generation] for lineage in lineages }
+                parents = { lineage[generation].solution_id: lineage[generation - 1] for lineage in lineages } if generation > 0 and mode == 'delta' else None
+                writer.append(generation, solutions, parents)
+            write_time = timer() - start_time
+            writer.close()
+
+            archive = GenomeArchive(archive_file)
+            start_time = timer()
+            for row in np.random.default_rng(0).permutation(len(archive)):
+                archive.decoded_genomes.clear()
+                archive.genome(row)
+            read_time = timer() - start_time
+            mean_chain = np.mean(archive.index['chain']) + 1
+
+            print('{:6.2f} {:>8} {:14.0f} {:12.3f} {:12.3f} {:18.1f}'.format(mutation_rate, mode, os.path.getsize(archive_file) / len(archive), write_time, read_time, mean_chain))
+            os.remove(archive_file)
+            os.remove(index_file_name(archive_file))
+
+def legacy_select(fitness, family1, family2, size, family_filter_size):
+    # select as it was: merge_sort over a dict, then taking the head of the list and removing it
+    sorted_individual_indices = merge_sort.merge_sort(dict(enumerate(fitness.tolist())))
+    next_generation = []
+    family_counts = {}
+    while len(next_generation) < size and len(sorted_individual_indices) > 0:
+        top_individual_index = sorted_individual_indices[0]
+        top_individual_family1 = int(family1[top_individual_index])
+        top_individual_family2 = int(family2[top_individual_index])
+        if top_individual_family1 not in family_counts:
+            family_counts[top_individual_family1] = 0
+        if top_individual_family2 not in family_counts:
+            family_counts[top_individual_family2] = 0
+        if family_counts[top_individual_family1] > family_filter_size or family_counts[top_individual_family2] > family_filter_size:
+            sorted_individual_indices.remove(top_individual_index)
+        else:
+            family_counts[top_individual_family1] += 1
+            family_counts[top_individual_family2] += 1
+            next_generation.append(top_individual_index)
+            sorted_individual_indices.remove(top_individual_index)
+    return next_generation
+
+def benchmark_selection(population_sizes, crossed_fraction, legacy_limit, repeats):
+    # survivor selection time against population size, with number_of_children + 1 solutions per
+    # survivor slot and about that many per family, as after a generation of breeding.
+    # Up to legacy_limit the old select is timed too and its survivors compared
+    print('{:>12} {:>14} {:>14} {:>8}'.format('population', 'engine (s)', 'legacy (s)', 'same'))
+    rng = np.random.default_rng(0)
+    for population_size in population_sizes:
+        size = max(1, population_size // (Cnsts.number_of_children + 1))
+        # fitnesses on a coarse grid, so there are ties to break the way select does
+        fitness = np.round(rng.random(population_size), 3)
+        family1 = rng.integers(0, max(1, population_size // (Cnsts.number_of_children + 1)), population_size)
+        family2 = family1.copy()
+        crossed = rng.random(population_size) < crossed_fraction
+        family2[crossed] = rng.integers(0, max(1, population_size // (Cnsts.number_of_children + 1)), np.count_nonzero(crossed))
+
+        engine_times = []
+        for repeat in range(repeats):
+            start_time = timer()
+            survivors = selection.select_survivors(fitness, family1, family2, size, Cnsts.family_filter_size)
+            engine_times.append(timer() - start_time)
+
+        legacy_time, same = float('nan'), ''
+        if population_size <= legacy_limit:
+            start_time = timer()
+            legacy_survivors = legacy_select(fitness, family1, family2, size, Cnsts.family_filter_size)
+            legacy_time = timer() - start_time
+            same = str(survivors[:len(legacy_survivors)].tolist() == legacy_survivors)
+
+        print('{:>12} {:14.4f} {:14.4f} {:>8}'.format(population_size, min(engine_times), legacy_time, same))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog = 'benchmarks.py',
+        description = 'Throughput and scaling benchmarks for pyro-corpus')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    batching_parser = subparsers.add_parser('batching', help='robots evaluated per second for several robots per world')
+    batching_parser.add_argument('-n', '--number-of-robots', type=int, default=64)
+    batching_parser.add_argument('-k', '--robots-per-world', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+
+    control_parser = subparsers.add_parser('control-period', help='fitness fidelity and speed across controller update periods')
+    control_parser.add_argument('-n', '--number-of-robots', type=int, default=32)
+    control_parser.add_argument('-c', '--control-periods', type=int, nargs='+', default=[1, 2, 4, 8])
+
+    compiler_parser = subparsers.add_parser('compiler', help='body plan compile time, cold and through the subtree cache, against number of parts')
+    compiler_parser.add_argument('-p', '--part-counts', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    compiler_parser.add_argument('-r', '--repeats', type=int, default=5)
+
+    reproduction_parser = subparsers.add_parser('reproduction', help='time and traced memory to breed children from large parent genomes')
+    reproduction_parser.add_argument('-p', '--number-of-parents', type=int, default=50)
+    reproduction_parser.add_argument('-n', '--number-of-children', type=int, default=10)
+    reproduction_parser.add_argument('-m', '--mutations-per-genome', type=int, default=300)
+
+    scheduling_parser = subparsers.add_parser('scheduling', help='generation makespan with chunked and longest-first dispatch')
+    scheduling_parser.add_argument('-n', '--number-of-robots', type=int, default=128)
+    scheduling_parser.add_argument('-r', '--repeats', type=int, default=2)
+
+    lineage_parser = subparsers.add_parser('lineage', help='archive size and speed storing children whole and as deltas against their parents')
+    lineage_parser.add_argument('-p', '--number-of-parents', type=int, default=20)
+    lineage_parser.add_argument('-g', '--generations', type=int, default=20)
+    lineage_parser.add_argument('-m', '--mutations-per-genome', type=int, default=300)
+    lineage_parser.add_argument('-r', '--mutation-rates', type=float, nargs='+', default=[Cnsts.mutation_rate, 0.05])
+
+    selection_parser = subparsers.add_parser('selection', help='family-aware survivor selection time against population size')
+    selection_parser.add_argument('-n', '--population-sizes', type=int, nargs='+', default=[10**3, 10**4, 10**5, 10**6])
+    selection_parser.add_argument('-x', '--crossed-fraction', type=float, default=0.0, help='fraction of solutions whose two families differ')
+    selection_parser.add_argument('-l', '--legacy-limit', type=int, default=10**4, help='largest population to also run the old select on')
+    selection_parser.add_argument('-r', '--repeats', type=int, default=3)
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'batching':
+        benchmark_batching(args.number_of_robots, args.robots_per_world)
+    elif args.benchmark == 'control-period':
+        benchmark_control_period(args.number_of_robots, args.control_periods)
+    elif args.benchmark == 'compiler':
+        benchmark_compiler(args.part_counts, args.repeats)
+    elif args.benchmark == 'reproduction':
+        benchmark_reproduction(args.number_of_parents, args.number_of_children, args.mutations_per_genome)
+    elif args.benchmark == 'scheduling':
+        benchmark_scheduling(args.number_of_robots, args.repeats)
+    elif args.benchmark == 'lineage':
+        benchmark_lineage(args.number_of_parents, args.generations, args.mutations_per_genome, args.mutation_rates)
+    elif args.benchmark == 'selection':
+        benchmark_selection(args.population_sizes, args.crossed_fraction, args.legacy_limit, args.repeats)
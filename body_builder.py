@@ -1,23 +1,40 @@
 from __future__ import annotations
 import pyrosim_z as psz
+import pybullet as pblt
 from typing import NamedTuple
 from body_parts import *
+from body_compiler import *
 import random
 import numpy as np
 
+JOINT_TYPES = {
+    'revolute'  : pblt.JOINT_REVOLUTE,
+    'fixed'     : pblt.JOINT_FIXED
+}
+
+# what pyrosim writes into every URDF link and revolute joint, so a body built in memory is the robot loadURDF would make
+LINK_MASS = 1.0
+LINK_INERTIA_DIAGONAL = [1.0, 1.0, 1.0]
+JOINT_LOWER_LIMIT = -3.14159
+JOINT_UPPER_LIMIT = 3.14159
+
+def sensor_neuron_name(part_id: str) -> str:
+    return "SNx" + str(part_id) + "x"
+
+def motor_neuron_name(joint_name: str) -> str:
+    return "MNx" + joint_name + "x"
+
 def build_neurons(joint_names: list[str], sensor_parts: list[str]):
     sensor_neurons = []
     motor_neurons = []
 
     for part_id in sensor_parts:
-        sensor_neuron_name = "SNx" + str(part_id) + "x"
-        psz.Send_Sensor_Neuron(name=sensor_neuron_name, linkName=str(part_id))
-        sensor_neurons.append(sensor_neuron_name)
+        psz.Send_Sensor_Neuron(name=sensor_neuron_name(part_id), linkName=str(part_id))
+        sensor_neurons.append(sensor_neuron_name(part_id))
 
     for joint_name in joint_names:
-        motor_neuron_name = "MNx" + joint_name + "x"
-        psz.Send_Motor_Neuron(name=motor_neuron_name, jointName=joint_name)
-        motor_neurons.append(motor_neuron_name)
+        psz.Send_Motor_Neuron(name=motor_neuron_name(joint_name), jointName=joint_name)
+        motor_neurons.append(motor_neuron_name(joint_name))
 
     return sensor_neurons, motor_neurons
 
@@ -41,93 +58,104 @@ def build_brain(joint_names, sensor_parts):
 
     return weight_matrix
 
-def build_body(body_plan: BodyCons):
-    abstract_centers        = []
-    joint_names             = []
-    sensor_parts            = []
-
-    def build_body_recursively(body_plan: BodyCons, upstream_position: Position, upstream_cube_element: CubeElement, parrent_part_id: int, parent_center: Union[Position, None]=None, parent_size: Union[Dimensions, None]=None, parent_abstract_position: Union[Position, None]=None):
-        body_cons_id                                    = body_plan.body_cons_id
-        body_part: BodyPart                             = body_plan.body_part
-        build_specifications: list[BuildSpecifications] = body_plan.build_specifications
-        next_body_plans                                 = body_plan.next_body_plans
+def create_brain(joint_names, sensor_parts, previous_weights: Union[NeuronWeightMatrix, None]=None, random_state: np.random.RandomState=np.random):
+    sensor_neurons = [sensor_neuron_name(part_id) for part_id in sensor_parts]
+    motor_neurons = [motor_neuron_name(joint_name) for joint_name in joint_names]
 
-        current_specification: BuildSpecifications = build_specifications[0]
+    if previous_weights is not None and previous_weights.has_neurons(sensor_neurons, motor_neurons):
+        return previous_weights
 
-        direction_to_build = current_specification.direction_to_build
-        repetitions = current_specification.repitions
-        axis = current_specification.axis
+    return NeuronWeightMatrix(sensor_neurons, motor_neurons, previous_weights, random_state)
 
-        specific_body_cons_id = "{}r{}".format(body_cons_id, repetitions)
-        current_part_id = specific_body_cons_id
+def write_brain(joint_names, sensor_parts, weight_matrix: NeuronWeightMatrix):
+    build_neurons(joint_names, sensor_parts)
 
-        if body_part.get_properties()['brain'] == True:
-            current_part_id = current_part_id + 'B'
+    build_synapses(weight_matrix)
 
-        if parrent_part_id == -1:
-            my_abstract_position = Position(0, 0, 0)
+def build_body(body_plan: BodyCons):
+    body = describe_body(body_plan)
+
+    write_body(body)
+
+    abstract_centers = [Position(*cell) for cell in body.parts['cell'].tolist()]
+
+    return body.joint_names, body.sensor_parts, abstract_centers
+
+def write_body(body: CompiledBody):
+    parts = body.parts
+    for row in range(len(parts)):
+        if row > 0:
+            psz.send_joint(
+                name=body.joint_names[row - 1],
+                parent=body.part_names[parts['parent'][row]],
+                child=body.part_names[row],
+                type=JOINT_TYPE_NAMES[parts['joint_type'][row]],
+                position=parts['joint_position'][row].tolist(),
+                axis=AXES_ORDER[parts['axis'][row]].value)
+
+        body_part = part_class(parts, row)
+        psz.send_link(
+            name=body.part_names[row],
+            pos_xyz=parts['center'][row].tolist(),
+            shape="box",
+            size_string="{} {} {}".format(*parts['size'][row].tolist()),
+            color_name=body_part.color_name,
+            color=body_part.color)
+
+def create_multibody(body: CompiledBody, base_position: Position=Position(0, 0, 0), visual: bool=True) -> tuple[int, list[int]]:
+    # builds the robot straight into the physics client; row i of the part table is pybullet link i - 1.
+    # Returns the body id and the collision shapes made for it, which outlive the body until removed;
+    # visual shapes, which pybullet cannot remove, are only made when visual is set, i.e. for the GUI
+    parts = body.parts
+    half_extents = (0.5 * parts['size']).tolist()
+    centers = parts['center'].tolist()
+
+    collision_shapes = []
+    visual_shapes = []
+    for row in range(len(parts)):
+        collision_shapes.append(pblt.createCollisionShape(pblt.GEOM_BOX, halfExtents=half_extents[row], collisionFramePosition=centers[row]))
+        if visual:
+            visual_shapes.append(pblt.createVisualShape(pblt.GEOM_BOX, halfExtents=half_extents[row], rgbaColor=part_class(parts, row).color, visualFramePosition=centers[row]))
         else:
-            joint_name: str = create_joint(
-                upstream_center=parent_center,
-                parent_part_size=parent_size,
-                joint_attachment_element=direction_to_build,
-                joint_type=body_part.properties['joint'],
-                axis=axis,
-                parent_part_id=parrent_part_id,
-                current_part_id=current_part_id)
-            my_abstract_position = Position(*add_xyz(parent_abstract_position, direction_to_build.value))
-            joint_names.append(joint_name)
-
-        my_center, my_size = body_part.create_body_part(
-            upstream_position=upstream_position,
-            attachment_point_on_child=direction_to_build,
-            piece_id=current_part_id)
-        
-        if body_part.get_properties()['sensor'] == True or body_part.get_properties()['brain'] == True:
-            sensor_parts.append(current_part_id)
-        
-        if my_abstract_position in abstract_centers:
-            raise ValueError("Center already in design, cannot build")
-        abstract_centers.append(my_abstract_position)
-        
-        repetitions_left = repetitions - 1
-
-        if repetitions_left <= 0 and next_body_plans is None:
-            return
-
-        if repetitions_left <= 0:
-            next_parent_id = current_part_id
-            for direction in next_body_plans:
-                next_body_plan = next_body_plans[direction]
-                build_body_recursively(body_plan=next_body_plan,
-                                                            upstream_position=(0, 0, 0),
-                                                            upstream_cube_element=direction,
-                                                            parrent_part_id=next_parent_id,
-                                                            parent_center=my_center,
-                                                            parent_size=my_size,
-                                                            parent_abstract_position=my_abstract_position)
-            return
-        
-        new_build_specifications = [BuildSpecifications(direction_to_build=direction_to_build, repitions=repetitions_left, axis=axis)]
-        
-        next_body_plan = BodyCons(body_cons_id=body_cons_id,
-                                  body_part=body_part,
-                                  build_specifications=new_build_specifications,
-                                  next_body_plans=next_body_plans)
-        return  build_body_recursively(body_plan=next_body_plan,
-                                      upstream_position=(0, 0, 0),
-                                      upstream_cube_element=direction_to_build,
-                                      parrent_part_id=current_part_id,
-                                      parent_center=my_center,
-                                      parent_size=my_size,
-                                      parent_abstract_position=my_abstract_position)
-    
-    build_body_recursively(body_plan=body_plan,
-                           upstream_position=Position(0, 0, 2),
-                           upstream_cube_element=CubeElement.CENTER,
-                           parrent_part_id=-1)
-    
-    return joint_names, sensor_parts, abstract_centers
+            visual_shapes.append(-1)
+
+    number_of_links = len(parts) - 1
+    joint_types = [JOINT_TYPES[JOINT_TYPE_NAMES[joint_type]] for joint_type in parts['joint_type'][1:].tolist()]
+    joint_axes = [AXES_ORDER[axis].value for axis in parts['axis'][1:].tolist()]
+
+    body_id = pblt.createMultiBody(
+        baseMass=LINK_MASS,
+        baseCollisionShapeIndex=collision_shapes[0],
+        baseVisualShapeIndex=visual_shapes[0],
+        basePosition=list(base_position),
+        baseInertialFramePosition=centers[0],
+        linkMasses=[LINK_MASS] * number_of_links,
+        linkCollisionShapeIndices=collision_shapes[1:],
+        linkVisualShapeIndices=visual_shapes[1:],
+        linkPositions=parts['joint_position'][1:].tolist(),
+        linkOrientations=[[0, 0, 0, 1]] * number_of_links,
+        linkInertialFramePositions=centers[1:],
+        linkInertialFrameOrientations=[[0, 0, 0, 1]] * number_of_links,
+        linkParentIndices=parts['parent'][1:].tolist(),
+        linkJointTypes=joint_types,
+        linkJointAxis=joint_axes)
+
+    # createMultiBody takes inertia from the collision boxes and leaves joints unlimited
+    for link_index in range(-1, number_of_links):
+        pblt.changeDynamics(body_id, link_index, localInertiaDiagonal=LINK_INERTIA_DIAGONAL)
+    for link_index, joint_type in enumerate(joint_types):
+        if joint_type == pblt.JOINT_REVOLUTE:
+            pblt.changeDynamics(body_id, link_index, jointLowerLimit=JOINT_LOWER_LIMIT, jointUpperLimit=JOINT_UPPER_LIMIT)
+
+    return body_id, collision_shapes
+
+def describe_body(body_plan: BodyCons) -> CompiledBody:
+    body = compile_body(body_plan)
+
+    if len(find_collisions(body.parts)) > 0:
+        raise ValueError("Center already in design, cannot build")
+
+    return body
 
 
 if __name__ == '__main__':
@@ -0,0 +1,197 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import NamedTuple
+import numpy as np
+from body_parts import *
+import constants as Cnsts
+
+# Expands a PRIF body plan into a flat table with one row per part, in the order the recursive
+# builder used to emit them (each chain of repetitions, then its next_body_plans depth first).
+# Row 0 is the root part; every other row i is attached to parts[i]['parent'] by joint i - 1.
+# The URDF writer, createMultiBody, the brain builder and the validator all work from this table.
+
+UPSTREAM_POSITION = (0.0, 0.0, 2.0)
+ZERO_XYZ = (0.0, 0.0, 0.0)
+
+JOINT_TYPE_NAMES = ('revolute', 'fixed')
+
+PART_DTYPE = np.dtype([
+    ('bodycons_id',     np.int64),
+    ('repetition',      np.int32),
+    ('parent',          np.int32),
+    ('depth',           np.int32),
+    ('part_type',       np.int8),
+    ('joint_type',      np.int8),
+    ('axis',            np.int8),
+    ('direction',       np.int8),
+    ('sensor',          np.bool_),
+    ('brain',           np.bool_),
+    ('cell',            np.int32, (3,)),
+    ('size',            np.float64, (3,)),
+    ('center',          np.float64, (3,)),
+    ('joint_position',  np.float64, (3,))
+])
+
+class CompiledBody(NamedTuple):
+    parts:          np.ndarray
+    part_names:     list[str]
+    joint_names:    list[str]
+    sensor_parts:   list[str]
+    brain_parts:    list[str]
+
+class CompiledSubtree(NamedTuple):
+    body_plan:  BodyCons
+    parts:      np.ndarray
+    part_names: list[str]
+    start:      int
+    end:        int
+
+# Compiled subtrees keyed by the id() of their BodyCons. Mutations never change a plan in place,
+# they build new BodyCons along the path to the change and share every other subtree, so a subtree
+# seen before can be copied in from the table it was compiled into instead of being walked again.
+# Entries keep a strong reference to their plan so the id cannot be reused while it is cached.
+SUBTREE_CACHE: OrderedDict[int, CompiledSubtree] = OrderedDict()
+
+def cached_subtree(body_plan: BodyCons) -> Union[CompiledSubtree, None]:
+    entry = SUBTREE_CACHE.get(id(body_plan))
+    if entry is None or entry.body_plan is not body_plan:
+        return None
+    SUBTREE_CACHE.move_to_end(id(body_plan))
+    return entry
+
+def cache_subtree(entry: CompiledSubtree) -> None:
+    SUBTREE_CACHE[id(entry.body_plan)] = entry
+    SUBTREE_CACHE.move_to_end(id(entry.body_plan))
+    while len(SUBTREE_CACHE) > Cnsts.subtree_cache_size:
+        SUBTREE_CACHE.popitem(last=False)
+
+def clear_subtree_cache() -> None:
+    SUBTREE_CACHE.clear()
+
+def splice_subtree(entry: CompiledSubtree, start: int, parent_row: int, first_cell: tuple[int, int, int], depth: int) -> np.ndarray:
+    # moves a cached block of rows to its new place: parents are shifted to the new row numbers,
+    # and cells and depths are shifted so its first part lands on first_cell at depth
+    subtree_root = entry.parts[entry.start]
+
+    block = entry.parts[entry.start:entry.end].copy()
+    block['cell'] += np.subtract(first_cell, subtree_root['cell'], dtype=np.int32)
+    block['depth'] += depth - subtree_root['depth']
+    block['parent'] += start - entry.start
+    block['parent'][0] = parent_row
+    return block
+
+def compile_body(body_plan: BodyCons, geometry: bool = True) -> CompiledBody:
+    # a pure function of the plan: sizes come from the plan, so the same plan always compiles to the same table;
+    # geometry=False skips placing the parts, the validator only needs the grid cells
+    segments    = []
+    rows        = []
+    part_names  = []
+    walked      = []
+
+    plans_to_compile = [(body_plan, -1, None, 0)]
+
+    while plans_to_compile:
+        current_plan, parent_row, parent_cell, depth = plans_to_compile.pop()
+
+        build_specifications: BuildSpecifications = current_plan.build_specifications[0]
+        direction = build_specifications.direction_to_build.value
+        if parent_cell is None:
+            cell = (0, 0, 0)
+        else:
+            cell = (parent_cell[0] + direction[0], parent_cell[1] + direction[1], parent_cell[2] + direction[2])
+
+        start = len(part_names)
+
+        entry = cached_subtree(current_plan)
+        if entry is not None:
+            if rows:
+                segments.append(np.array(rows, dtype=PART_DTYPE))
+                rows = []
+            segments.append(splice_subtree(entry, start, parent_row, cell, depth))
+            part_names.extend(entry.part_names[entry.start:entry.end])
+            walked.append((None, start, depth))
+            continue
+
+        walked.append((current_plan, start, depth))
+
+        body_part: BodyPart = current_plan.body_part
+        properties = body_part.get_properties()
+        part_type = PART_CLASSES.index(type(body_part))
+        joint_type = JOINT_TYPE_NAMES.index(properties.joint)
+        axis = AXIS_TAGS[build_specifications.axis]
+        direction_index = CUBE_ELEMENT_TAGS[build_specifications.direction_to_build]
+        brain = properties.brain
+        sensor = properties.sensor or brain
+        size = part_dimensions(current_plan)
+        repetitions_to_build = range(build_specifications.repitions, 0, -1) if build_specifications.repitions > 0 else [build_specifications.repitions]
+
+        for repetition in repetitions_to_build:
+            if len(part_names) > start:
+                cell = (cell[0] + direction[0], cell[1] + direction[1], cell[2] + direction[2])
+
+            rows.append((current_plan.body_cons_id, repetition, parent_row, depth, part_type, joint_type, axis, direction_index, sensor, brain, cell, size, ZERO_XYZ, ZERO_XYZ))
+            part_names.append("{}r{}".format(current_plan.body_cons_id, repetition) + ('B' if brain else ''))
+
+            parent_row = len(part_names) - 1
+
+        if current_plan.next_body_plans is not None:
+            for next_body_plan in reversed(list(current_plan.next_body_plans.values())):
+                plans_to_compile.append((next_body_plan, parent_row, cell, depth + 1))
+
+    if rows:
+        segments.append(np.array(rows, dtype=PART_DTYPE))
+    parts = np.concatenate(segments) if len(segments) > 1 else segments[0]
+    # the subtree cache keeps views of these rows, so they are read-only from here on; geometry works on a copy
+    parts.flags.writeable = False
+
+    cache_walked_subtrees(walked, parts, part_names)
+
+    if geometry:
+        parts = parts.copy()
+        place_parts(parts)
+
+    return name_parts(parts, list(part_names))
+
+def cache_walked_subtrees(walked: list, parts: np.ndarray, part_names: list[str]) -> None:
+    # in depth first order a subtree's rows run from its first part up to the next plan at the same or a shallower depth
+    open_subtrees = []
+    for body_plan, start, depth in walked:
+        while open_subtrees and open_subtrees[-1][2] >= depth:
+            closed_plan, closed_start, closed_depth = open_subtrees.pop()
+            if closed_plan is not None:
+                cache_subtree(CompiledSubtree(closed_plan, parts, part_names, closed_start, start))
+        open_subtrees.append((body_plan, start, depth))
+
+    while open_subtrees:
+        closed_plan, closed_start, closed_depth = open_subtrees.pop()
+        if closed_plan is not None:
+            cache_subtree(CompiledSubtree(closed_plan, parts, part_names, closed_start, len(parts)))
+
+def place_parts(parts: np.ndarray) -> None:
+    # each part's link frame is its joint frame, so a part's center is half its size along the
+    # build direction, and its joint sits on the parent's face in that same direction
+    directions = np.array([element.value for element in CUBE_ELEMENTS_ORDER], dtype=np.float64)[parts['direction']]
+
+    sizes = parts['size']
+    parts['center'] = 0.5 * sizes * directions
+    parts['center'][0] += UPSTREAM_POSITION
+
+    parents = parts['parent'][1:]
+    parts['joint_position'][1:] = parts['center'][parents] + 0.5 * sizes[parents] * directions[1:]
+
+def name_parts(parts: np.ndarray, part_names: list[str]) -> CompiledBody:
+    joint_names = [part_names[parent] + "_" + part_names[row] for row, parent in enumerate(parts['parent'].tolist()) if parent != -1]
+    sensor_parts = [part_names[row] for row in np.flatnonzero(parts['sensor'])]
+    brain_parts = [part_names[row] for row in np.flatnonzero(parts['brain'])]
+
+    return CompiledBody(parts, part_names, joint_names, sensor_parts, brain_parts)
+
+def find_collisions(parts: np.ndarray) -> np.ndarray:
+    # grid cells holding more than one part
+    if len(parts) == 0:
+        return np.zeros((0, 3), dtype=np.int32)
+    cells, counts = np.unique(parts['cell'], axis=0, return_counts=True)
+    return cells[counts > 1]
+
+def part_class(parts: np.ndarray, row: int) -> type:
+    return PART_CLASSES[parts['part_type'][row]]
@@ -1,8 +1,12 @@
 from __future__ import annotations
-import copy
+import logging
 from body_parts import *
+from body_validator import validate_body_plan
+import constants as Cnsts
 import random
 
+logger = logging.getLogger(__name__)
+
 BASE_BODYPLAN = BodyCons(0, FixedSizedUnchangeableBrain(), [BuildSpecifications(CubeElement.FRONT, 1, Axes.Y)], None)
 
 BASE_BODYCONS_ID = 0
@@ -42,7 +46,7 @@ def pick_mutation(mutation_weighting: list[float], mutation_options: list[functi
 def modify_body_type(current_body_plan: BodyCons, next_bodycons_id:int):
     new_body_type = current_body_type = current_body_plan.body_part
 
-    if current_body_type.properties['unchangeable'] == True:
+    if current_body_type.properties.unchangeable:
         mutation = pick_mutation(BODYCONS_MUTATION_WEIGHTING, BODYCONS_MUTATIONS)
 
         mutated_body_plan = mutation(current_body_plan, next_bodycons_id)
@@ -52,11 +56,11 @@ def modify_body_type(current_body_plan: BodyCons, next_bodycons_id:int):
     while type(new_body_type) is type(current_body_type):
         new_body_type = random.choice(BODY_TYPES)
     
-    new_body_plan = BodyCons(current_body_plan.body_cons_id, new_body_type, current_body_plan.build_specifications, current_body_plan.next_body_plans)
+    new_body_plan = BodyCons(current_body_plan.body_cons_id, new_body_type, current_body_plan.build_specifications, current_body_plan.next_body_plans, current_body_plan.dimensions)
     return new_body_plan
 
 def modify_build_sepcs(current_body_plan: BodyCons, next_bodycons_id:int):
-    if current_body_plan.body_part.properties['unchangeable'] == True:
+    if current_body_plan.body_part.properties.unchangeable:
         mutation = pick_mutation(BODYCONS_MUTATION_WEIGHTING, BODYCONS_MUTATIONS)
 
         mutated_body_plan = mutation(current_body_plan, next_bodycons_id)
@@ -67,7 +71,7 @@ def modify_build_sepcs(current_body_plan: BodyCons, next_bodycons_id:int):
 
     new_build_specifications = spec_mutation(current_body_plan.build_specifications[0])
 
-    new_body_plan = BodyCons(current_body_plan.body_cons_id, current_body_plan.body_part, [new_build_specifications], current_body_plan.next_body_plans)
+    new_body_plan = BodyCons(current_body_plan.body_cons_id, current_body_plan.body_part, [new_build_specifications], current_body_plan.next_body_plans, current_body_plan.dimensions)
     return new_body_plan
 
 def modify_next(current_body_plan: BodyCons, next_bodycons_id:int):
@@ -83,7 +87,7 @@ def modify_next(current_body_plan: BodyCons, next_bodycons_id:int):
 
     new_next = next_mutation(current_body_plan.next_body_plans, next_direction, next_bodycons_id)
 
-    new_body_plan = BodyCons(current_body_plan.body_cons_id, current_body_plan.body_part, current_body_plan.build_specifications, new_next)
+    new_body_plan = BodyCons(current_body_plan.body_cons_id, current_body_plan.body_part, current_body_plan.build_specifications, new_next, current_body_plan.dimensions)
 
     return new_body_plan
 
@@ -122,21 +126,20 @@ def change_axis(current_build_specifications: BuildSpecifications):
 # next body plan mutations
 
 def add_new_next_direction(current_next: BodyCons, direction: CubeElement, next_bodycons_id:int):
-    new_next = copy.copy(current_next)
-    if new_next is None:
-        new_next = {}
-    new_next[direction] = BodyCons(next_bodycons_id, random.choice(BODY_TYPES), [BuildSpecifications(random.choice(DIRECTIONS_TO_BUILD), 1, random.choice(AXES))], None)
+    new_next = dict(current_next) if current_next is not None else {}
+    new_body_type = random.choice(BODY_TYPES)
+    new_next[direction] = BodyCons(next_bodycons_id, new_body_type, [BuildSpecifications(random.choice(DIRECTIONS_TO_BUILD), 1, random.choice(AXES))], None, new_body_type.sample_size())
 
-    return new_next
+    return NextBodyPlans(new_next)
 
 def change_bodyplan_for_direction(current_next: dict[CubeElement, BodyCons], direction: CubeElement, next_bodycons_id:int):
     mutation = pick_mutation(BODYCONS_MUTATION_WEIGHTING, BODYCONS_MUTATIONS)
 
-    new_next = current_next.copy()
+    new_next = dict(current_next)
 
     new_next[direction] = mutation(current_next[direction], next_bodycons_id) 
 
-    return new_next
+    return NextBodyPlans(new_next)
 
 # mutation lists
 
@@ -155,25 +158,35 @@ NEXT_MUTATION_WEIGHTING = [0.8, 0.2]
 # mutation algorithm
 
 def run_mutator(current_body_plan:BodyCons, current_bodycons_id:int, number_of_mutations: int):
-    mutated_body_plan = BodyCons(current_body_plan.body_cons_id, current_body_plan.body_part, current_body_plan.build_specifications, current_body_plan.next_body_plans)
+    mutated_body_plan = BodyCons(current_body_plan.body_cons_id, current_body_plan.body_part, current_body_plan.build_specifications, current_body_plan.next_body_plans, current_body_plan.dimensions)
 
     for i in range(number_of_mutations):
         mutated_body_plan, _ = mutate(mutated_body_plan, current_bodycons_id + i)
 
     return mutated_body_plan
 
-def mutate(current_body_plan:BodyCons, current_bodycons_id:int):
+def mutate(current_body_plan:BodyCons, current_bodycons_id:int, max_attempts: int = Cnsts.max_mutation_attempts):
+    # only ever returns valid plans: mutations that make parts overlap are redrawn up to
+    # max_attempts times, after which the (valid) plan is returned unchanged
     new_bodycons_id = current_bodycons_id + 1
 
-    mutation = pick_mutation(BODYCONS_MUTATION_WEIGHTING, BODYCONS_MUTATIONS)
+    for attempt in range(max_attempts):
+        mutation = pick_mutation(BODYCONS_MUTATION_WEIGHTING, BODYCONS_MUTATIONS)
+
+        mutated_body_plan = mutation(current_body_plan, new_bodycons_id)
 
-    mutated_body_plan = mutation(current_body_plan, new_bodycons_id)
+        validation_report = validate_body_plan(mutated_body_plan)
+        if validation_report.valid:
+            if attempt > 0:
+                logger.debug("valid body plan after %d rejected mutations", attempt)
+            return mutated_body_plan, new_bodycons_id
 
-    return mutated_body_plan, new_bodycons_id
+    logger.warning("no valid mutation found in %d attempts, keeping the body plan unchanged", max_attempts)
+    return current_body_plan, new_bodycons_id
 
 
 if __name__ == '__main__':
-    initial_body_plan = copy.deepcopy(BASE_BODYPLAN)
+    initial_body_plan = BASE_BODYPLAN
     print(initial_body_plan)
 
     print()
@@ -1,5 +1,4 @@
 from __future__ import annotations
-import pyrosim_z as psz
 from typing import NamedTuple
 from typing import Union
 from enum import Enum
@@ -8,6 +7,9 @@ import numpy as np
 
 VALID_CUBE_ELEMENTS = (1, 6)
 
+PART_SIZE_MINS = (0.2, 0.2, 0.1)
+PART_SIZE_MAXES = (1, 1, 0.6)
+
 class CubeElement(Enum):
     CENTER              = (0, 0, 0)
     FRONT               = (1, 0, 0)
@@ -42,6 +44,11 @@ class Axes(Enum):
     Y   =   [0, 1, 0]
     Z   =   [0, 0, 1]
 
+CUBE_ELEMENTS_ORDER = tuple(CubeElement)
+AXES_ORDER = tuple(Axes)
+CUBE_ELEMENT_TAGS = { element: tag for tag, element in enumerate(CUBE_ELEMENTS_ORDER) }
+AXIS_TAGS = { axis: tag for tag, axis in enumerate(AXES_ORDER) }
+
 class Position(NamedTuple):
     x:  float
     y:  float
@@ -52,24 +59,86 @@ class Dimensions(NamedTuple):
     width:  float
     height: float
 
+class NextBodyPlans(dict):
+    # next_body_plans of a BodyCons. Read only, so a mutated plan can share every subtree it did not
+    # change with its parent: mutators build a new NextBodyPlans instead of editing one
+
+    def read_only(self, *args, **kwargs):
+        raise TypeError("next_body_plans are shared between body plans and cannot be changed")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = read_only
+
+    def __reduce__(self):
+        return (NextBodyPlans, (dict(self),))
+
 class BodyCons(NamedTuple):
     body_cons_id:           int
     body_part:              Union[BodyPart, BodyCons]
     build_specifications:   list[BuildSpecifications]
     next_body_plans:        Union[dict[CubeElement, BodyCons], None]=None
+    dimensions:             Union[Dimensions, None]=None
+
+    def __reduce__(self):
+        # genomes go through pickle for every pool task and every saved genome, so a BodyCons pickles
+        # as a flat list of records, one per plan depth first with its directions as small ints;
+        # pickle would otherwise recurse once per level of nesting
+        records = []
+        plans_to_record = [self]
+        while plans_to_record:
+            body_plan = plans_to_record.pop()
+            direction_tags = None
+            if body_plan.next_body_plans is not None:
+                direction_tags = tuple(CUBE_ELEMENT_TAGS[direction] for direction in body_plan.next_body_plans)
+                plans_to_record.extend(reversed(list(body_plan.next_body_plans.values())))
+            dimensions = None if body_plan.dimensions is None else tuple(body_plan.dimensions)
+            records.append((body_plan.body_cons_id, body_plan.body_part, tuple(body_plan.build_specifications), direction_tags, dimensions))
+        return (body_cons_from_records, (records,))
 
 class BuildSpecifications(NamedTuple):
     direction_to_build: CubeElement=CubeElement.FRONT
     repitions:      int=1
     axis:           Axes=Axes.X
 
+    def __reduce__(self):
+        return (build_specifications_from_record, (CUBE_ELEMENT_TAGS[self.direction_to_build], self.repitions, AXIS_TAGS[self.axis]))
+
 class Genome(NamedTuple):
     bodycons_id:        int
     brain_chromosome:   NeuronWeightMatrix
     body_chromosome:    BodyCons
 
-def create_random_xyz(mins: Union[float, Dimensions, Position], maxes: Union[float, Dimensions, Position]) -> Union[Dimensions, Position]:
-    return tuple(mins[index] + (maxes[index] - mins[index]) * random.random() for index in range(3))
+def body_cons_from_records(records: list) -> BodyCons:
+    # rebuilt from the last record back: every plan's children are already built, on top of the stack in order
+    built_plans = []
+    for body_cons_id, body_part, build_specifications, direction_tags, dimensions in reversed(records):
+        next_body_plans = None
+        if direction_tags is not None:
+            next_body_plans = NextBodyPlans({ CUBE_ELEMENTS_ORDER[tag]: built_plans.pop() for tag in direction_tags })
+        if dimensions is not None:
+            dimensions = Dimensions(*dimensions)
+        built_plans.append(BodyCons(body_cons_id, body_part, list(build_specifications), next_body_plans, dimensions))
+    return built_plans[0]
+
+# genomes pickled one record per plan, before plans were pickled as a flat list, still load through this
+def body_cons_from_record(body_cons_id: int, body_part: BodyPart, build_specifications: tuple, next_body_plans: Union[tuple, None], dimensions: Union[tuple, None]) -> BodyCons:
+    if next_body_plans is not None:
+        next_body_plans = NextBodyPlans({ CUBE_ELEMENTS_ORDER[tag]: next_body_plan for tag, next_body_plan in next_body_plans })
+    if dimensions is not None:
+        dimensions = Dimensions(*dimensions)
+    return BodyCons(body_cons_id, body_part, list(build_specifications), next_body_plans, dimensions)
+
+def build_specifications_from_record(direction_tag: int, repitions: int, axis_tag: int) -> BuildSpecifications:
+    return BuildSpecifications(CUBE_ELEMENTS_ORDER[direction_tag], repitions, AXES_ORDER[axis_tag])
+
+def create_random_xyz(mins: Union[float, Dimensions, Position], maxes: Union[float, Dimensions, Position], rng: random.Random = random) -> Union[Dimensions, Position]:
+    return tuple(mins[index] + (maxes[index] - mins[index]) * rng.random() for index in range(3))
+
+def part_dimensions(body_plan: BodyCons) -> Dimensions:
+    # every repetition of a BodyCons is built with the dimensions stored in it; plans made before
+    # dimensions were stored get sizes seeded by their bodycons id, so they still build the same body every time
+    if body_plan.dimensions is not None:
+        return body_plan.dimensions
+    return body_plan.body_part.sample_size(random.Random(body_plan.body_cons_id))
 
 def add_xyz(xyz_tuple1: Union[Position, Dimensions, tuple[float, float, float]], xyz_tuple2: Union[Position, Dimensions, tuple[float, float, float]]) -> tuple[float, float, float]:
     return tuple(map(lambda var1, var2: var1 + var2, xyz_tuple1, xyz_tuple2))
@@ -80,263 +149,141 @@ def scalar_multiplication_xyz(scalar: float, xyz_tuple: Union[Position, Dimensio
 def element_wise_multiplication_xyz(xyz_tuple1: Union[Position, Dimensions, tuple[float, float, float]], xyz_tuple2: Union[Position, Dimensions, tuple[float, float, float]]) -> tuple[float, float, float]:
     return tuple(map(lambda var1, var2: var1 * var2, xyz_tuple1, xyz_tuple2))
 
-def create_joint(upstream_center: Position, parent_part_size: Dimensions, joint_attachment_element: CubeElement, joint_type:str, axis: list[Union[float, int]], parent_part_id: int, current_part_id: int) -> str:
-    joint_name = "" + str(parent_part_id) + "_" + str(current_part_id) + ""
-
-    joint_attachment_point = add_xyz(
-        upstream_center,
-        element_wise_multiplication_xyz(
-            scalar_multiplication_xyz(
-                0.5,
-                parent_part_size),
-            joint_attachment_element.value)
-        )
-    
-    psz.send_joint(
-        name=joint_name,
-        parent=str(parent_part_id),
-        child=str(current_part_id),
-        type=joint_type,
-        position=list(joint_attachment_point),
-        axis=axis.value)
-    
-    return joint_name
+class PartProperties(NamedTuple):
+    sensor:         bool
+    joint:          str
+    unchangeable:   bool
+    brain:          bool
+
+PART_PROPERTIES: dict[PartProperties, PartProperties] = {}
+
+def part_properties(sensor: bool, joint: str = 'revolute', unchangeable: bool = False, brain: bool = False) -> PartProperties:
+    # interned, so part types with the same properties share one record
+    properties = PartProperties(sensor, joint, unchangeable, brain)
+    return PART_PROPERTIES.setdefault(properties, properties)
+
+PART_INSTANCES: dict[type, BodyPart] = {}
 
 class BodyPart():
+    # Part types are flyweights: each class has one instance, shared by every genome, with no
+    # per-instance state. They pickle as their index in PART_CLASSES
 
-    def __init__(self):
-        self.properties = {
-            'sensor'        : True,
-            'joint'         : 'revolute',
-            'unchangeable'  : False,
-            'brain'         : False
-        }
+    __slots__ = ()
 
-    def get_properties(self):
+    color_name  = 'Blue'
+    color       = [0.0, 0.0, 1.0, 1.0]
+    properties  = part_properties(sensor=True)
+
+    def __new__(cls):
+        if cls not in PART_INSTANCES:
+            PART_INSTANCES[cls] = super().__new__(cls)
+        return PART_INSTANCES[cls]
+
+    def __reduce__(self):
+        return (body_part_from_tag, (PART_CLASSES.index(type(self)),))
+
+    def __setstate__(self, state):
+        # parts pickled before they were flyweights carry a properties dict (and a size) that the class now holds
+        pass
+
+    def get_properties(self) -> PartProperties:
         return self.properties
 
-    def create_body_part(self, upstream_position: Position, attachment_point_on_child: CubeElement, piece_id: int) -> tuple(Position, Dimensions):
-        return self.create_body_part(upstream_position, attachment_point_on_child, piece_id)
+    def sample_size(self, rng: random.Random = random) -> Dimensions:
+        return Dimensions(*create_random_xyz(PART_SIZE_MINS, PART_SIZE_MAXES, rng))
     
 class RandomSizeBodyPiece(BodyPart):
     
-    def __init__(self):
-        super().__init__()
-        self.properties['sensor'] = False
-
-    def create_body_part(self, attachment_point_on_child: CubeElement, piece_id: int, upstream_position: Position = Position(0, 0, 0)) -> tuple(Position, Dimensions):
-        size: Dimensions = Dimensions(*create_random_xyz(Dimensions(0.2, 0.2, 0.1), Dimensions(1, 1, 0.6)))
-
-        center: Position = add_xyz(
-            upstream_position, #ONLY USED IN INITIAL PIECE
-            element_wise_multiplication_xyz(
-                scalar_multiplication_xyz(
-                    0.5,
-                    size),
-                attachment_point_on_child.value))
-
-        psz.send_link(
-            name=str(piece_id),
-            pos_xyz=list(center),
-            shape="box",
-            size_string="{} {} {}".format(*list(size)),
-            color_name='Blue',
-            color=[0.0, 0.0, 1.0, 1.0])
-
-        return center, size
+    __slots__ = ()
+
+    properties  = part_properties(sensor=False)
     
 class RandomSizeSensorPiece(BodyPart):
     
-    def __init__(self):
-        super().__init__()
-        self.properties['sensor'] = True
-
-    def create_body_part(self, attachment_point_on_child: CubeElement, piece_id: int, upstream_position: Position = Position(0, 0, 0)) -> tuple(Position, Dimensions):
-        size: Dimensions = Dimensions(*create_random_xyz(Dimensions(0.2, 0.2, 0.1), Dimensions(1, 1, 0.6)))
-
-        center: Position = add_xyz(
-            upstream_position, #ONLY USED IN INITIAL PIECE
-            element_wise_multiplication_xyz(
-                scalar_multiplication_xyz(
-                    0.5,
-                    size),
-                attachment_point_on_child.value))
-
-        psz.send_link(
-            name=str(piece_id),
-            pos_xyz=list(center),
-            shape="box",
-            size_string="{} {} {}".format(*list(size)),
-            color_name='Green',
-            color=[0.0, 1.0, 0.0, 1.0])
-
-        return center, size
+    __slots__ = ()
+
+    color_name  = 'Green'
+    color       = [0.0, 1.0, 0.0, 1.0]
+    properties  = part_properties(sensor=True)
     
 class FixedSizeBodyPiece(BodyPart):
     
-    def __init__(self, size: float=1):
-        super().__init__()
-        self.properties['sensor'] = False
-        self.size = size
-
-    def create_body_part(self, attachment_point_on_child: CubeElement, piece_id: int, upstream_position: Position = Position(0, 0, 0)) -> tuple(Position, Dimensions):
-        size: Dimensions = Dimensions(*create_random_xyz(Dimensions(0.2, 0.2, 0.1), Dimensions(1, 1, 0.6)))
-
-        center: Position = add_xyz(
-            upstream_position, #ONLY USED IN INITIAL PIECE
-            element_wise_multiplication_xyz(
-                scalar_multiplication_xyz(
-                    0.5,
-                    size),
-                attachment_point_on_child.value))
-
-        psz.send_link(
-            name=str(piece_id),
-            pos_xyz=list(center),
-            shape="box",
-            size_string="{} {} {}".format(*list(size)),
-            color_name='Blue',
-            color=[0.0, 0.0, 1.0, 1.0])
-
-        return center, size
+    __slots__ = ()
+
+    properties  = part_properties(sensor=False)
     
 class FixedSizeSensorPiece(BodyPart):
     
-    def __init__(self, size: float=1):
-        super().__init__()
-        self.properties['sensor'] = True
-        self.size = size
-
-    def create_body_part(self, attachment_point_on_child: CubeElement, piece_id: int, upstream_position: Position = Position(0, 0, 0)) -> tuple(Position, Dimensions):
-        size: Dimensions = Dimensions(*create_random_xyz(Dimensions(0.2, 0.2, 0.1), Dimensions(1, 1, 0.6)))
-
-        center: Position = add_xyz(
-            upstream_position, #ONLY USED IN INITIAL PIECE
-            element_wise_multiplication_xyz(
-                scalar_multiplication_xyz(
-                    0.5,
-                    size),
-                attachment_point_on_child.value))
-
-        psz.send_link(
-            name=str(piece_id),
-            pos_xyz=list(center),
-            shape="box",
-            size_string="{} {} {}".format(*list(size)),
-            color_name='Green', 
-            color=[0.0, 1.0, 0.0, 1.0])
-
-        return center, size
+    __slots__ = ()
+
+    color_name  = 'Green'
+    color       = [0.0, 1.0, 0.0, 1.0]
+    properties  = part_properties(sensor=True)
     
 class FixedSizeUnmovableBodyPiece(BodyPart):
     
-    def __init__(self, size: float=1):
-        super().__init__()
-        self.properties['sensor'] = False
-        self.properties['joint'] = 'fixed'
-        self.size = size
-
-    def create_body_part(self, attachment_point_on_child: CubeElement, piece_id: int, upstream_position: Position = Position(0, 0, 0)) -> tuple(Position, Dimensions):
-        size: Dimensions = Dimensions(*create_random_xyz(Dimensions(0.2, 0.2, 0.1), Dimensions(1, 1, 0.6)))
-
-        center: Position = add_xyz(
-            upstream_position, #ONLY USED IN INITIAL PIECE
-            element_wise_multiplication_xyz(
-                scalar_multiplication_xyz(
-                    0.5,
-                    size),
-                attachment_point_on_child.value))
-
-        psz.send_link(
-            name=str(piece_id),
-            pos_xyz=list(center),
-            shape="box",
-            size_string="{} {} {}".format(*list(size)),
-            color_name='Purple',
-            color=[0.5, 0.0, 0.5, 1.0])
-
-        return center, size
+    __slots__ = ()
+
+    color_name  = 'Purple'
+    color       = [0.5, 0.0, 0.5, 1.0]
+    properties  = part_properties(sensor=False, joint='fixed')
     
 class FixedSizeUnmovableSensorPiece(BodyPart):
     
-    def __init__(self, size: float=1):
-        super().__init__()
-        self.properties['sensor'] = True
-        self.properties['joint'] = 'fixed'
-        self.size = size
-
-    def create_body_part(self, attachment_point_on_child: CubeElement, piece_id: int, upstream_position: Position = Position(0, 0, 0)) -> tuple(Position, Dimensions):
-        size: Dimensions = Dimensions(*create_random_xyz(Dimensions(0.2, 0.2, 0.1), Dimensions(1, 1, 0.6)))
-
-        center: Position = add_xyz(
-            upstream_position, #ONLY USED IN INITIAL PIECE
-            element_wise_multiplication_xyz(
-                scalar_multiplication_xyz(
-                    0.5,
-                    size),
-                attachment_point_on_child.value))
-
-        psz.send_link(
-            name=str(piece_id),
-            pos_xyz=list(center),
-            shape="box",
-            size_string="{} {} {}".format(*list(size)),
-            color_name='Orange',
-            color=[1.0, 0.35, 0.2, 1.0])
-
-        return center, size
+    __slots__ = ()
+
+    color_name  = 'Orange'
+    color       = [1.0, 0.35, 0.2, 1.0]
+    properties  = part_properties(sensor=True, joint='fixed')
     
 class FixedSizedUnchangeableBrain(BodyPart):
     
-    def __init__(self, size: float=1):
-        super().__init__()
-        self.properties['sensor'] = True
-        self.properties['unchangeable'] = True
-        self.properties['brain'] = True
-        self.size = size
-
-    def create_body_part(self, attachment_point_on_child: CubeElement, piece_id: int, upstream_position: Position = Position(0, 0, 0)) -> tuple(Position, Dimensions):
-        size: Dimensions = Dimensions(*create_random_xyz(Dimensions(0.2, 0.2, 0.1), Dimensions(1, 1, 0.6)))
-
-        center: Position = add_xyz(
-            upstream_position, #ONLY USED IN INITIAL PIECE
-            element_wise_multiplication_xyz(
-                scalar_multiplication_xyz(
-                    0.5,
-                    size),
-                attachment_point_on_child.value))
-
-        psz.send_link(
-            name=str(piece_id),
-            pos_xyz=list(center),
-            shape="box",
-            size_string="{} {} {}".format(*list(size)),
-            color_name='Black',
-            color=[0.0, 0.0, 0.0, 1.0])
-
-        return center, size
+    __slots__ = ()
+
+    color_name  = 'Black'
+    color       = [0.0, 0.0, 0.0, 1.0]
+    properties  = part_properties(sensor=True, unchangeable=True, brain=True)
+
+# index of a part's class in this tuple is its part type in compiled body tables
+PART_CLASSES = (
+    BodyPart,
+    RandomSizeBodyPiece,
+    RandomSizeSensorPiece,
+    FixedSizeBodyPiece,
+    FixedSizeSensorPiece,
+    FixedSizeUnmovableBodyPiece,
+    FixedSizeUnmovableSensorPiece,
+    FixedSizedUnchangeableBrain
+)
+
+def body_part_from_tag(tag: int) -> BodyPart:
+    return PART_CLASSES[tag]()
 
 class NeuronWeightMatrix():
     
-    def __init__(self, sensor_neurons: list[str], motor_neurons: list[str], previous_weights: Union[NeuronWeightMatrix, None] = None) -> None:
+    def __init__(self, sensor_neurons: list[str], motor_neurons: list[str], previous_weights: Union[NeuronWeightMatrix, None] = None, random_state: np.random.RandomState = np.random) -> None:
         self.shape = (len(sensor_neurons), len(motor_neurons))
         self.sensors = { sensor_neurons[x]: x for x in range(len(sensor_neurons)) }
         self.motors = { motor_neurons[x]: x for x in range(len(motor_neurons)) }
         self.matrix = np.full(self.shape, np.nan)
 
         if previous_weights is not None:
-            generator_sensors = (sensor for sensor in self.sensors if sensor in previous_weights.get_sensors())
-            generator_motors = (motor for motor in self.motors if motor in previous_weights.get_motors())
+            shared_sensors = [sensor for sensor in self.sensors if sensor in previous_weights.get_sensors()]
+            shared_motors = [motor for motor in self.motors if motor in previous_weights.get_motors()]
 
-            for sensor in generator_sensors:
-                for motor in generator_motors:
+            for sensor in shared_sensors:
+                for motor in shared_motors:
                     self_sensor_index = self.sensors[sensor]
                     self_motor_index = self.motors[motor]
                     previous_sensor_index = previous_weights.get_sensors()[sensor]
                     previous_motor_index = previous_weights.get_motors()[motor]
-                    self.matrix[self_sensor_index, self_motor_index] = previous_weights.get_weights[previous_sensor_index, previous_motor_index]
+                    self.matrix[self_sensor_index, self_motor_index] = previous_weights.get_weights()[previous_sensor_index, previous_motor_index]
+
+        self.matrix[np.isnan(self.matrix)] = random_state.randn(len(self.matrix[np.isnan(self.matrix)]))
+        self.matrix.flags.writeable = False
 
-        self.matrix[np.isnan(self.matrix)] = np.random.randn(len(self.matrix[np.isnan(self.matrix)]))
+    def __reduce__(self):
+        return (weight_matrix_from_record, (list(self.sensors), list(self.motors), self.matrix))
 
     def get_sensors(self):
         return self.sensors
@@ -348,9 +295,31 @@ class NeuronWeightMatrix():
         return self.matrix
     
     def set_weights(self, weights):
-        self.matrix = weights
+        # weights can be shared with other matrices, so they are only ever replaced, never written to
+        self.matrix = weights.view()
+        self.matrix.flags.writeable = False
+
+    def with_weights(self, weights) -> NeuronWeightMatrix:
+        # copy on write: the new matrix shares the neuron index maps and only holds its own weights
+        weight_matrix = NeuronWeightMatrix.__new__(NeuronWeightMatrix)
+        weight_matrix.shape = self.shape
+        weight_matrix.sensors = self.sensors
+        weight_matrix.motors = self.motors
+        weight_matrix.set_weights(weights)
+        return weight_matrix
+
+    def has_neurons(self, sensor_neurons: list[str], motor_neurons: list[str]) -> bool:
+        return list(self.sensors) == list(sensor_neurons) and list(self.motors) == list(motor_neurons)
     
     def get(self, sensor, motor):
         sensor_index = self.sensors[sensor]
         motor_index = self.motors[motor]
         return self.matrix[sensor_index, motor_index]
+
+def weight_matrix_from_record(sensor_neurons: list[str], motor_neurons: list[str], weights: np.ndarray) -> NeuronWeightMatrix:
+    weight_matrix = NeuronWeightMatrix.__new__(NeuronWeightMatrix)
+    weight_matrix.shape = (len(sensor_neurons), len(motor_neurons))
+    weight_matrix.sensors = { sensor_neurons[x]: x for x in range(len(sensor_neurons)) }
+    weight_matrix.motors = { motor_neurons[x]: x for x in range(len(motor_neurons)) }
+    weight_matrix.set_weights(weights)
+    return weight_matrix
@@ -0,0 +1,22 @@
+from __future__ import annotations
+from typing import NamedTuple
+from body_parts import *
+from body_compiler import compile_body, find_collisions
+
+
+class ValidationReport(NamedTuple):
+    valid:          bool
+    collisions:     list[tuple[int, int, int]]
+    depth:          int
+    part_count:     int
+
+def validate_body_plan(body_plan: BodyCons) -> ValidationReport:
+    # Lays the plan out on the same grid cells describe_body checks, without building any geometry.
+    # Every part is an abstract unit cube, so two parts overlap exactly when they land on the same cell.
+    parts = compile_body(body_plan, geometry=False).parts
+    collisions = [tuple(cell) for cell in find_collisions(parts).tolist()]
+
+    return ValidationReport(len(collisions) == 0, collisions, int(parts['depth'].max()) + 1, len(parts))
+
+def is_valid_body_plan(body_plan: BodyCons) -> bool:
+    return validate_body_plan(body_plan).valid
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import os
+import pickle
+import random
+from typing import NamedTuple, Union
+
+import numpy as np
+from body_parts import *
+import genome_format
+
+# Everything FAERYvPyrCor1MP needs to carry on from the end of a generation exactly as if it had
+# never stopped: the population, every random generator the main process draws from, the seed the
+# pool workers' seed sequences are spawned from, and the run's history. Genomes pickle compactly,
+# so a checkpoint is a few kilobytes per parent.
+
+CHECKPOINT_VERSION = 3
+
+class Checkpoint(NamedTuple):
+    version:                int
+    generation:             int
+    parents:                dict[int, tuple[Genome, float]]
+    next_available_id:      int
+    seed_entropy:           int
+    random_state:           tuple
+    numpy_random_state:     tuple
+    generator_state:        dict
+    max_fitnesses:          list[float]
+    fitness_curve:          list[tuple[int, float, float]]
+    evaluations:            int
+    busy_time:              float
+    elapsed_time:           float
+    fitness_cache_entries:  list[tuple[str, float]]
+    cost_model_state:       tuple
+    control_period:         int
+    robots_per_world:       int
+    archive_file:           Union[str, None]=None
+    archive_records:        int=0
+
+def create_checkpoint(evolutionary_algorithm, generation: int, elapsed_time: float) -> Checkpoint:
+    cost_model = evolutionary_algorithm.cost_model
+    return Checkpoint(
+        version=CHECKPOINT_VERSION,
+        generation=generation,
+        parents={ parent_id: (parent.genome, parent.fitness) for parent_id, parent in evolutionary_algorithm.parents.items() },
+        next_available_id=evolutionary_algorithm.next_available_id,
+        seed_entropy=evolutionary_algorithm.seed_sequence.entropy,
+        random_state=random.getstate(),
+        numpy_random_state=np.random.get_state(),
+        generator_state=evolutionary_algorithm.rng.bit_generator.state,
+        max_fitnesses=list(evolutionary_algorithm.max_fitnesses),
+        fitness_curve=list(evolutionary_algorithm.fitness_curve),
+        evaluations=evolutionary_algorithm.evaluations,
+        busy_time=evolutionary_algorithm.busy_time,
+        elapsed_time=elapsed_time,
+        fitness_cache_entries=list(evolutionary_algorithm.fitness_cache.entries.items()),
+        cost_model_state=(list(cost_model.features), list(cost_model.step_times), cost_model.coefficients),
+        control_period=evolutionary_algorithm.control_period,
+        robots_per_world=evolutionary_algorithm.robots_per_world,
+        archive_file=evolutionary_algorithm.archive_file,
+        archive_records=evolutionary_algorithm.archive.records if evolutionary_algorithm.archive is not None else 0)
+
+def save_checkpoint(checkpoint: Checkpoint, file_name: str) -> None:
+    # written next to the old checkpoint and moved over it, so a run killed mid-write keeps the previous one
+    os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+    temporary_file_name = file_name + ".tmp"
+    with open(temporary_file_name, "wb") as fp:
+        pickle.dump(checkpoint, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_file_name, file_name)
+
+def load_checkpoint(file_name: str) -> Checkpoint:
+    with open(file_name, "rb") as fp:
+        checkpoint = pickle.load(fp)
+
+    if not isinstance(checkpoint, Checkpoint) or checkpoint.version != CHECKPOINT_VERSION:
+        raise ValueError("{} is not a version {} checkpoint".format(file_name, CHECKPOINT_VERSION))
+    return checkpoint
+
+def check_settings(checkpoint: Checkpoint, control_period: int, robots_per_world: int) -> None:
+    # a run carries on under the simulation settings it started with, or its fitnesses stop being comparable
+    if (checkpoint.control_period, checkpoint.robots_per_world) != (control_period, robots_per_world):
+        raise ValueError("checkpoint was run with control period {} and {} robots per world, not {} and {}".format(
+            checkpoint.control_period, checkpoint.robots_per_world, control_period, robots_per_world))
+
+def restore_random_states(checkpoint: Checkpoint, generator: np.random.Generator) -> None:
+    random.setstate(checkpoint.random_state)
+    np.random.set_state(checkpoint.numpy_random_state)
+    generator.bit_generator.state = checkpoint.generator_state
+
+def load_genomes(file_names: list[str]) -> list[Genome]:
+    # warm start sources: saved genome files, or checkpoints, whose parents are taken best first
+    genomes = []
+    for file_name in file_names:
+        loaded = genome_format.load_genome(file_name)
+
+        if isinstance(loaded, Checkpoint):
+            ranked_parents = sorted(loaded.parents.values(), key=lambda parent: parent[1], reverse=True)
+            genomes.extend(genome for genome, fitness in ranked_parents)
+        else:
+            genomes.append(loaded)
+    return genomes
@@ -23,4 +23,42 @@ random_members = 3
 CPG_magnitude = 2
 CPG_period_modifier = 2*np.pi
 
-num_simulations_at_once = 5
\ No newline at end of file
+num_simulations_at_once = 5
+
+export_robot_files = False
+
+fitness_cache_size = 10000
+fitness_cache_file = "./data/output/fitness_cache"
+
+early_stopping = True
+stop_check_interval = 100
+stall_window = 2000
+stall_min_progress = 0.05
+min_base_height = None
+min_base_uprightness = None
+max_progress_per_step = 0.002
+
+robots_per_world = 1
+robot_spacing = 10
+
+control_period = 1
+
+random_seed = None
+
+max_mutation_attempts = 100
+
+subtree_cache_size = 20000
+
+cost_model_history = 2000
+cost_model_min_samples = 20
+
+async_in_flight_per_worker = 2
+
+checkpoint_interval = 1
+checkpoint_file = "./data/output/checkpoint_{}.pyckpt"
+
+archive_genomes = True
+archive_file = "./data/output/archive_{}.prif"
+# at mutation_rate 0.75 nearly every weight changes, so deltas save little and cost more to write and read
+archive_deltas = False
+archive_snapshot_interval = 10
@@ -0,0 +1,44 @@
+from __future__ import annotations
+from collections import deque
+import numpy as np
+from body_parts import *
+from body_compiler import compile_body, JOINT_TYPE_NAMES
+import constants as Cnsts
+
+# Predicts how long a genome takes to simulate from its compiled body, so evaluations can be sent
+# out longest first and one slow morphology does not hold up the end of a generation.
+# Cost is simulation time per physics step, linear in [1, parts, revolute joints, sensors],
+# refit by least squares on the most recent measured evaluations.
+
+FEATURE_NAMES = ('constant', 'parts', 'joints', 'sensors')
+
+def body_features(body_plan: BodyCons) -> np.ndarray:
+    parts = compile_body(body_plan, geometry=False).parts
+    joints = np.count_nonzero(parts['joint_type'][1:] == JOINT_TYPE_NAMES.index('revolute'))
+    return np.array([1.0, len(parts), joints, np.count_nonzero(parts['sensor'])])
+
+class CostModel:
+
+    def __init__(self, history: int = Cnsts.cost_model_history, min_samples: int = Cnsts.cost_model_min_samples) -> None:
+        self.features = deque(maxlen=history)
+        self.step_times = deque(maxlen=history)
+        self.min_samples = min_samples
+        # until there are enough timings, cost is taken to grow with the number of parts
+        self.coefficients = np.array([1.0, 1.0, 0.0, 0.0])
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        return np.maximum(np.atleast_2d(features) @ self.coefficients, 1e-9)
+
+    def observe(self, features: np.ndarray, elapsed: float, steps_run: int) -> None:
+        if steps_run > 0:
+            self.features.append(features)
+            self.step_times.append(elapsed / steps_run)
+
+    def fit(self) -> None:
+        if len(self.step_times) < self.min_samples:
+            return
+        self.coefficients = np.linalg.lstsq(np.array(self.features), np.array(self.step_times), rcond=None)[0]
+
+    def longest_first(self, features: np.ndarray) -> np.ndarray:
+        # indices of the tasks, most expensive first
+        return np.argsort(-self.predict(features), kind='stable')
@@ -0,0 +1,143 @@
+from collections import deque
+import queue
+from timeit import default_timer as timer
+
+import numpy as np
+from solution import Solution, evaluate_genome
+import constants as Cnsts
+
+from fitness_cache import FitnessCache
+import stopping_criteria
+import selection
+import world
+from faery_pc1mp import FAERYvPyrCor1MP, breed_child
+from solution_ids import pack_solution_id, family_of
+
+import multiprocessing as mp
+
+
+def breed_and_evaluate(child_id, parent_genome, seed_sequence, stop_criteria=(), control_period=Cnsts.control_period):
+    # runs in a pool worker: the child is bred where it is simulated, and its genome comes back with its result
+    child_id, child_genome = breed_child(child_id, parent_genome, seed_sequence)
+    return child_genome, evaluate_genome(child_id, child_genome, stop_criteria, control_period)
+
+def evaluate_new_member(solution_id, genome, stop_criteria=(), control_period=Cnsts.control_period):
+    return genome, evaluate_genome(solution_id, genome, stop_criteria, control_period)
+
+
+class FAERYvPyrCor1Async(FAERYvPyrCor1MP):
+    # FAERYvPyrCor1Async: steady-state FAERYvPyrCor1MP with no generation barrier
+    # Up to max_in_flight evaluations are kept running; each one that returns is put into the population
+    # under the same family rules as select, and another child is bred and sent out straight away.
+    # As select lets each generation's new members skip the family filter once, the random_members
+    # most recently returned random members keep a place whatever their fitness, until newer ones take it.
+    # It spends the same number of evaluations as the generational driver, and a "generation" here
+    # is that many evaluations, for the fitness curves and for child and random member ids.
+    # Results arrive in whatever order workers finish, so runs are not reproducible from the seed alone.
+
+    def __init__(self, control_period = Cnsts.control_period, seed = Cnsts.random_seed, max_in_flight = None) -> None:
+        super().__init__(robots_per_world=1, control_period=control_period, seed=seed)
+        self.max_in_flight = max_in_flight if max_in_flight is not None else Cnsts.async_in_flight_per_worker * mp.cpu_count()
+
+        self.children_per_generation = self.generation_size * self.number_of_children
+        self.evaluations_per_generation = self.children_per_generation + self.random_members
+        self.child_counts = {}
+        self.child_parents = {}
+        self.random_member_ids = set()
+        self.newest_random_members = deque(maxlen=self.random_members)
+
+    def evolve(self) -> None:
+        self.pool = mp.Pool(mp.cpu_count(), initializer=world.start_shared_world)
+        # children are bred in the workers, so there is no genome to look up before one is sent out and
+        # results are not stored; the cache, kept in memory, only serves evaluate for the first parents
+        self.fitness_cache = FitnessCache(store_file=None, control_period=self.control_period)
+        self.open_archive()
+        self.start_time = timer()
+
+        try:
+            self.evaluate(self.parents)
+            self.archive_solutions(0, self.parents)
+            self.evolve_steady_state(Cnsts.num_generations * self.evaluations_per_generation)
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.fitness_cache.close()
+            self.close_archive()
+
+        self.print_utilization()
+        return self.show_best()
+
+    def evolve_steady_state(self, number_of_evaluations) -> None:
+        finished = queue.Queue()
+        dispatched = 0
+        in_flight = 0
+
+        while dispatched < number_of_evaluations or in_flight > 0:
+            while in_flight < self.max_in_flight and dispatched < number_of_evaluations:
+                self.dispatch(dispatched, finished)
+                dispatched += 1
+                in_flight += 1
+
+            outcome = finished.get()
+            in_flight -= 1
+            if isinstance(outcome, BaseException):
+                raise outcome
+
+            genome, result = outcome
+            self.insert(genome, result)
+
+    def dispatch(self, evaluation_number, finished) -> None:
+        generation, position = divmod(evaluation_number, self.evaluations_per_generation)
+        stop_criteria = stopping_criteria.default_stop_criteria(self.worst_fitness(self.parents)) if Cnsts.early_stopping else ()
+        task_options = { 'stop_criteria': stop_criteria, 'control_period': self.control_period }
+
+        if position >= self.children_per_generation:
+            new_id = self.random_member_id(generation, position - self.children_per_generation)
+            new_member = Solution(solution_id=new_id)
+            self.random_member_ids.add(new_id)
+            self.pool.apply_async(evaluate_new_member, (new_id, new_member.genome), task_options, callback=finished.put, error_callback=finished.put)
+            return
+
+        parent_ids = sorted(self.parents)
+        parent = parent_ids[self.rng.integers(len(parent_ids))]
+
+        # numbered per family and generation so two parents from one family cannot hand out the same id
+        family = family_of(parent)
+        child_num = self.child_counts.get((generation, family), 0)
+        self.child_counts[(generation, family)] = child_num + 1
+
+        child_id = pack_solution_id(generation + 1, family, family, child_num)
+        self.child_parents[child_id] = self.parents[parent]
+        child_seed_sequence = np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=(generation + 1, evaluation_number))
+        self.pool.apply_async(breed_and_evaluate, (child_id, self.parents[parent].genome, child_seed_sequence), task_options, callback=finished.put, error_callback=finished.put)
+
+    def insert(self, genome, result) -> None:
+        solution = Solution(result.solution_id, genome)
+        solution.set_fitness(result.fitness, result.elapsed)
+        solution.rebuild_brain(result.joint_names, result.sensor_parts)
+
+        self.busy_time += result.elapsed
+        parents = {}
+        if result.solution_id in self.child_parents:
+            parents[result.solution_id] = self.child_parents.pop(result.solution_id)
+        self.archive_solutions((self.evaluations - self.generation_size) // self.evaluations_per_generation + 1, { result.solution_id: solution }, parents)
+        self.evaluations += 1
+
+        if result.solution_id in self.random_member_ids:
+            self.random_member_ids.remove(result.solution_id)
+            self.newest_random_members.append(result.solution_id)
+        self.parents = self.family_filter(self.parents | { result.solution_id: solution }, self.generation_size)
+
+        best_fitness = self.parents.rows['fitness'].max()
+        self.fitness_curve.append((self.evaluations, timer() - self.start_time, best_fitness))
+        if (self.evaluations - self.generation_size) % self.evaluations_per_generation == 0:
+            self.max_fitnesses.append(best_fitness)
+            print("\np max: {} \t\t p mean: {} \t\t evaluations: {}\n".format(best_fitness, np.mean(self.parents.rows['fitness']), self.evaluations))
+
+    def family_filter(self, individuals, size):
+        # the newest random members are kept; everyone else goes through select's rule for the places
+        # left, with the best of those it turns away filling up the population if it leaves it short
+        protected = np.isin(individuals.rows['solution_id'], np.array(self.newest_random_members, dtype=np.uint64))
+        competing = np.flatnonzero(~protected)
+        survivors = competing[selection.select_survivors(individuals.rows['fitness'][competing], individuals.rows['family1'][competing], individuals.rows['family2'][competing], size - np.count_nonzero(protected), self.family_filter_size)]
+        return individuals.take(np.concatenate([survivors, np.flatnonzero(protected)]))
@@ -1,30 +1,86 @@
-import copy
 from datetime import datetime
+import functools
+from timeit import default_timer as timer
 import os
 import pickle
 import random
 
 import numpy as np
-import merge_sort
-from solution import Solution
+from solution import Solution, evaluate_genome, evaluate_genomes
 import constants as Cnsts
 
-import body_builder
 import body_mutator
 import brain_mutator
 from body_parts import *
+import genome_format
+import selection
+from genome_archive import GenomeArchiveWriter
+from population_table import PopulationTable
+from solution_ids import pack_solution_id, family_of
+from fitness_cache import FitnessCache, genome_hash
+from cost_model import CostModel, body_features
+import checkpoint
+import stopping_criteria
+import world
 
 import multiprocessing as mp
 
 
+def run_simulation(solution_id, genome, stop_criteria=(), control_period=Cnsts.control_period):
+    # runs in a pool worker; tasks carry only an id and a genome, and results are a small EvaluationResult
+    return evaluate_genome(solution_id, genome, stop_criteria, control_period)
+
+def run_simulation_tasks(tasks, stop_criteria=(), control_period=Cnsts.control_period):
+    # each robot in its own world, one after the other
+    return [run_simulation(solution_id, genome, stop_criteria, control_period) for solution_id, genome in tasks]
+
+def run_simulation_batch(batch, stop_criteria=(), control_period=Cnsts.control_period):
+    solution_ids, genomes = zip(*batch)
+    return evaluate_genomes(solution_ids, genomes, stop_criteria, control_period)
+
+def seed_global_generators(seed_sequence):
+    # body_mutator and NeuronWeightMatrix draw from the module-level generators
+    random.seed(int(seed_sequence.generate_state(1)[0]))
+    np.random.seed(seed_sequence.generate_state(1))
+
+def breed_child(child_id, parent_genome, seed_sequence):
+    # every random draw for this child comes from its own seed sequence, so children do not depend
+    # on which worker bred them or in what order. Genomes are never changed in place, so the child
+    # is built on the parent genome directly and shares everything the mutation did not touch
+    seed_global_generators(seed_sequence)
+    rng = np.random.default_rng(seed_sequence)
+
+    child_body_chromosone, child_brain_chromosome, child_bodycons_id = mutate(parent_genome, rng)
+    return child_id, Genome(child_bodycons_id, child_brain_chromosome, child_body_chromosone)
+
+def breed_family(parent_genome, child_ids, seed_sequences):
+    # runs in a pool worker; one task per parent, so the parent genome is sent once per family and
+    # the children come back in one pickle that keeps the subtrees they share with each other shared
+    return [breed_child(child_id, parent_genome, seed_sequence) for child_id, seed_sequence in zip(child_ids, seed_sequences)]
+
+def mutate(genome_to_mutate, rng):
+    mutated_body_chromosome, new_bodycons_id = body_mutator.mutate(genome_to_mutate.body_chromosome, genome_to_mutate.bodycons_id)
+
+    if genome_to_mutate.brain_chromosome is not None:
+        mutated_brain_chromosome_weights = brain_mutator.mutate(genome_to_mutate.brain_chromosome, rng, genome_to_mutate.brain_chromosome.shape, Cnsts.mutation_rate, Cnsts.mutation_magnitude)
+
+        mutated_brain_chromosome = genome_to_mutate.brain_chromosome.with_weights(mutated_brain_chromosome_weights)
+    else:
+        mutated_brain_chromosome = None
+    
+    return mutated_body_chromosome, mutated_brain_chromosome, new_bodycons_id
+
+
 class FAERYvPyrCor1MP:
     # FAERYvPyrCor1MP: Family Aware EvolutionaRY algorithm for pyro-corpus 1 with multiprocessing
     # Based off of pyroFAE3
     
-    def __init__(self) -> None:
+    def __init__(self, robots_per_world = Cnsts.robots_per_world, control_period = Cnsts.control_period, seed = Cnsts.random_seed, checkpoint_file = Cnsts.checkpoint_file) -> None:
         os.system("rm ./data/robot/brain*.nndf")
         os.system("rm ./data/robot/body*.urdf")
-        self.parents = {}
+        self.seed_sequence = np.random.SeedSequence(seed)
+        seed_global_generators(self.seed_sequence)
+
         self.next_available_id = 0
 
         self.generation_size = Cnsts.generation_size
@@ -32,155 +88,269 @@ class FAERYvPyrCor1MP:
         self.family_filter_size = Cnsts.family_filter_size
         self.random_members = Cnsts.random_members
         self.total_filter_size = self.generation_size - self.random_members
+        self.robots_per_world = robots_per_world
+        self.control_period = control_period
 
+        parents = {}
         for parent_num in range(Cnsts.generation_size):
-            parent_id = "000" + f"{parent_num:03}" + f"{parent_num:03}" + "000"
-            self.parents[parent_id] = Solution(solution_id=parent_id)
+            parent_id = pack_solution_id(0, parent_num, parent_num, 0)
+            parents[parent_id] = Solution(solution_id=parent_id)
             self.next_available_id += 1
+        self.parents = PopulationTable(parents)
+        self.children = PopulationTable()
         
-        self.rng = np.random.default_rng()
+        self.rng = np.random.default_rng(self.seed_sequence)
         self.max_fitnesses = []
+        self.cost_model = CostModel()
+
+        # (evaluations, seconds, best fitness) after every generation, comparable across drivers
+        self.fitness_curve = []
+        self.evaluations = 0
+        self.busy_time = 0.0
+
+        # one checkpoint per run, named for when it started, so runs side by side do not overwrite each other's
+        self.checkpoint_file = checkpoint_file.format(datetime.now().strftime("%Y-%m-%d.%H_%M_%S_%f")) if checkpoint_file is not None else None
+        self.first_generation = 0
+        self.elapsed_before_resume = 0.0
+        self.fitness_cache_entries = []
+
+        # every evaluated genome goes into one archive per run
+        self.archive_file = None
+        self.archive_records = None
+        self.archive = None
 
     def evolve(self) -> None:
-        self.evaluate(self.parents)
+        self.pool = mp.Pool(mp.cpu_count(), initializer=world.start_shared_world)
+        self.fitness_cache = FitnessCache(control_period=self.control_period)
+        for key, fitness in self.fitness_cache_entries:
+            self.fitness_cache.remember(key, fitness)
+        self.open_archive()
+        self.start_time = timer() - self.elapsed_before_resume
 
-        for generation in range(Cnsts.num_generations):
-            os.system("rm ./data/robot/brain*.nndf")
-            os.system("rm ./data/robot/body*.urdf")
-            self.evolve_for_one_generation(generation)
-        
+        try:
+            # a resumed run already has its parents evaluated
+            if self.first_generation == 0:
+                self.evaluate(self.parents)
+                self.archive_solutions(0, self.parents)
+
+            for generation in range(self.first_generation, Cnsts.num_generations):
+                os.system("rm ./data/robot/brain*.nndf")
+                os.system("rm ./data/robot/body*.urdf")
+                self.evolve_for_one_generation(generation)
+
+                if self.checkpoint_file is not None and ((generation + 1) % Cnsts.checkpoint_interval == 0 or generation + 1 == Cnsts.num_generations):
+                    self.save_checkpoint(generation)
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.fitness_cache.close()
+            self.close_archive()
+
+        self.print_utilization()
         return self.show_best()
 
-    def evaluate(self, solutions) -> None:
-        pool = mp.Pool(mp.cpu_count())
-        results = pool.map(self.run_simulation, solutions.values(), chunksize=mp.cpu_count())
-        for result_tuple in results:
-            solutions[result_tuple[0]].set_fitness(result_tuple[1])
-        pool.close()
+    def open_archive(self) -> None:
+        if not Cnsts.archive_genomes:
+            return
+        if self.archive_file is None:
+            self.archive_file = Cnsts.archive_file.format(datetime.now().strftime("%Y-%m-%d.%H_%M_%S_%f"))
+        self.archive = GenomeArchiveWriter(self.archive_file)
 
-    def run_simulation(self, solution):
-        solution_fitness = solution.start_simulation()
-        return (solution.solution_id, solution_fitness)
-    
-    def evolve_for_one_generation(self, generation):
-        self.produce_children(generation)
-        self.evaluate(self.children)
-        self.print()
-        self.select(generation)
+        # a resumed run drops whatever the interrupted run archived after its checkpoint
+        if self.archive_records is not None:
+            self.archive.truncate(self.archive_records)
 
-    def produce_children(self, generation):
-        self.children = {}
-        for parent in self.parents:
-            for child_num in range(self.number_of_children):
-                child_id = f"{generation+1:03}" + parent[3:6] + parent[3:6] + f"{child_num:03}"
-                child_body_chromosone, child_brain_chromosome, child_bodycons_id = self.mutate(copy.deepcopy(self.parents[parent].genome), child_id)
-                child_genome = Genome(child_bodycons_id, child_brain_chromosome, child_body_chromosone)
-                self.children[child_id] = Solution(child_id, child_genome)
+    def archive_solutions(self, generation, solutions, parents=None) -> None:
+        # children are stored as deltas against the parents they were bred from
+        if self.archive is not None:
+            self.archive.append(generation, solutions, parents if Cnsts.archive_deltas else None)
 
-    def mutate(self, genome_to_mutate, genome_id):
-        running = True
+    def close_archive(self) -> None:
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
 
-        while running:
-            try:
-                mutated_body_chromosome, new_bodycons_id = body_mutator.mutate(genome_to_mutate.body_chromosome, genome_to_mutate.bodycons_id)
+    def save_checkpoint(self, generation) -> None:
+        checkpoint.save_checkpoint(checkpoint.create_checkpoint(self, generation, timer() - self.start_time), self.checkpoint_file)
 
-                psz.Start_URDF("./data/robot/body{}.urdf".format(genome_id))
+    def resume(self, saved_checkpoint) -> None:
+        # picks up after the checkpoint's generation with the population, generators and history
+        # exactly as they were, so the rest of the run matches one that was never interrupted
+        checkpoint.check_settings(saved_checkpoint, self.control_period, self.robots_per_world)
+        self.seed_sequence = np.random.SeedSequence(saved_checkpoint.seed_entropy)
+        checkpoint.restore_random_states(saved_checkpoint, self.rng)
 
-                body_builder.build_body(mutated_body_chromosome)
+        parents = {}
+        for parent_id, (genome, fitness) in saved_checkpoint.parents.items():
+            parents[parent_id] = Solution(parent_id, genome)
+            parents[parent_id].set_fitness(fitness)
+            parents[parent_id].rebuild_brain()
+        self.parents = PopulationTable(parents)
+        self.children = PopulationTable()
+        self.next_available_id = saved_checkpoint.next_available_id
 
-                psz.end()
+        self.max_fitnesses = list(saved_checkpoint.max_fitnesses)
+        self.fitness_curve = list(saved_checkpoint.fitness_curve)
+        self.evaluations = saved_checkpoint.evaluations
+        self.busy_time = saved_checkpoint.busy_time
+        self.elapsed_before_resume = saved_checkpoint.elapsed_time
+        self.fitness_cache_entries = saved_checkpoint.fitness_cache_entries
+        if saved_checkpoint.archive_file is not None:
+            self.archive_file = saved_checkpoint.archive_file
+            self.archive_records = saved_checkpoint.archive_records
 
-                running = False
+        features, step_times, coefficients = saved_checkpoint.cost_model_state
+        self.cost_model.features.extend(features)
+        self.cost_model.step_times.extend(step_times)
+        self.cost_model.coefficients = coefficients
 
-            except:
-                psz.end()
-                os.system("rm ./data/robot/body{}.urdf".format(genome_id))
-                print("invalid body plan, retrying")
-        
-        os.system("rm ./data/robot/body{}.urdf".format(genome_id))
+        self.first_generation = saved_checkpoint.generation + 1
+
+    def warm_start(self, genomes) -> None:
+        # the first parents are replaced by archived genomes; the rest stay random
+        parents = dict(self.parents.items())
+        for parent_num, genome in enumerate(genomes[:self.generation_size]):
+            parent_id = pack_solution_id(0, parent_num, parent_num, 0)
+            parents[parent_id] = Solution(parent_id, genome)
+        self.parents = PopulationTable(parents)
+
+    def print_utilization(self) -> None:
+        elapsed_time = timer() - self.start_time
+        print("\n{} evaluations in {:.1f} seconds, core utilization {:.1%}".format(self.evaluations, elapsed_time, self.busy_time / (elapsed_time * mp.cpu_count())))
+
+    def evaluate(self, solutions, cutoff_fitness=None) -> None:
+        # only one solution per distinct genome is simulated; everything else comes from the cache
+        self.evaluations += len(solutions)
+        solution_hashes = { solution_id: genome_hash(solutions[solution_id].genome) for solution_id in solutions }
+        to_simulate = {}
+        for solution_id, solution_hash in solution_hashes.items():
+            cached_fitness = self.fitness_cache.get(solution_hash)
+            if cached_fitness is not None:
+                solutions.set_fitness(solution_id, cached_fitness)
+                solutions[solution_id].rebuild_brain()
+            elif solution_hash not in to_simulate:
+                to_simulate[solution_hash] = solutions[solution_id]
 
-        if genome_to_mutate.brain_chromosome is not None:
-            mutated_brain_chromosome_weights = brain_mutator.mutate(genome_to_mutate.brain_chromosome, self.rng, genome_to_mutate.brain_chromosome.shape, Cnsts.mutation_rate, Cnsts.mutation_magnitude)
+        stop_criteria = stopping_criteria.default_stop_criteria(cutoff_fitness) if Cnsts.early_stopping else ()
+        results = self.simulate([(solution.solution_id, solution.genome) for solution in to_simulate.values()], stop_criteria)
+        simulated_results = {}
+        for result in results:
+            simulated_results[solution_hashes[result.solution_id]] = result
+            # a run cut short by a stop criterion is not the genome's fitness, only how far it got
+            if result.steps_run == Cnsts.num_iterations:
+                self.fitness_cache.put(solution_hashes[result.solution_id], result.fitness)
+            self.busy_time += result.elapsed
 
-            mutated_brain_chromosome = NeuronWeightMatrix(
-                sensor_neurons=list(genome_to_mutate.brain_chromosome.get_sensors().keys()),
-                motor_neurons=list(genome_to_mutate.brain_chromosome.get_motors().keys()),
-                previous_weights=None
-            )
+        for solution_id, solution_hash in solution_hashes.items():
+            if solution_hash in simulated_results:
+                result = simulated_results[solution_hash]
+                solutions.set_fitness(solution_id, result.fitness, result.elapsed)
+                solutions[solution_id].rebuild_brain(result.joint_names, result.sensor_parts)
+    
+    def simulate(self, tasks, stop_criteria):
+        # tasks go out most expensive first, one at a time, so workers that finish early pick up the
+        # remaining cheap ones instead of a slow robot ending the generation; with several robots
+        # per world, robots of similar cost share a world and the slowest worlds go first
+        if len(tasks) == 0:
+            return []
+
+        features = np.array([body_features(genome.body_chromosome) for solution_id, genome in tasks])
+        order = self.cost_model.longest_first(features)
 
-            mutated_brain_chromosome.set_weights(mutated_brain_chromosome_weights)
+        if self.robots_per_world <= 1:
+            batches = [[tasks[index]] for index in order]
+            run_batch = run_simulation_tasks
         else:
-            mutated_brain_chromosome = None
-        
-        return mutated_body_chromosome, mutated_brain_chromosome, new_bodycons_id
+            batches = [[tasks[index] for index in order[start:start + self.robots_per_world]] for start in range(0, len(tasks), self.robots_per_world)]
+            run_batch = run_simulation_batch
 
+        results = []
+        for batch_results in self.pool.imap_unordered(functools.partial(run_batch, stop_criteria=stop_criteria, control_period=self.control_period), batches, chunksize=1):
+            results.extend(batch_results)
 
-    def print(self) -> None:
-        parent_fitnesses = []
-        for key in self.parents:
-            parent_fitnesses.append(self.parents[key].fitness)
+        task_indices = { task[0]: index for index, task in enumerate(tasks) }
+        for result in results:
+            self.cost_model.observe(features[task_indices[result.solution_id]], result.elapsed, result.steps_run)
+        self.cost_model.fit()
 
-        child_fitnesses = []
-        for key in self.children:
-            child_fitnesses.append(self.children[key].fitness)
+        return results
+    
+    def evolve_for_one_generation(self, generation):
+        # the generation's random members are evaluated in the same batch as the children
+        self.produce_children(generation)
+        candidates = self.children | self.produce_random_members(generation)
+        self.evaluate(candidates, cutoff_fitness=self.worst_fitness(self.parents))
+        self.archive_solutions(generation + 1, candidates, self.child_parents)
+
+        self.children = candidates.take(np.arange(len(self.children)))
+        new_members = candidates.take(np.arange(len(self.children), len(candidates)))
+        self.print()
+        self.select(generation, new_members)
+
+    def produce_children(self, generation):
+        breeding_tasks = []
+        self.child_parents = {}
+        # children are numbered per family, so parents from one family never hand out the same id
+        family_child_counts = {}
+        for parent_num, parent in enumerate(self.parents):
+            family = family_of(parent)
+            child_ids = []
+            child_seed_sequences = []
+            for child_num in range(self.number_of_children):
+                child_ids.append(pack_solution_id(generation + 1, family, family, family_child_counts.get(family, 0)))
+                family_child_counts[family] = family_child_counts.get(family, 0) + 1
+                self.child_parents[child_ids[-1]] = self.parents[parent]
+                child_seed_sequences.append(np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=(generation + 1, parent_num, child_num)))
+            breeding_tasks.append((self.parents[parent].genome, child_ids, child_seed_sequences))
+
+        children = {}
+        for family in self.pool.starmap(breed_family, breeding_tasks):
+            for child_id, child_genome in family:
+                children[child_id] = Solution(child_id, child_genome)
+        self.children = PopulationTable(children)
+
+    def print(self) -> None:
+        parent_fitnesses = self.parents.rows['fitness']
+        child_fitnesses = self.children.rows['fitness']
 
         print("\np max: {} \t\t c max: {}".format(np.max(parent_fitnesses), np.max(child_fitnesses)))
         print("p mean: {} \t\t c mean: {}\n".format(np.mean(parent_fitnesses), np.mean(child_fitnesses)))
         self.max_fitnesses.append(max(np.max(parent_fitnesses), np.max(child_fitnesses)))
+        self.fitness_curve.append((self.evaluations, timer() - self.start_time, self.max_fitnesses[-1]))
 
-    def select(self, generation) -> None:
+    def select(self, generation, new_members) -> None:
         individuals = self.children | self.parents
-        sorted_individual_indices = self.sort_individuals(individuals)
-        next_generation = {}
-        family_counts = {}
-        top_individual_index = sorted_individual_indices[0]
-        top_individual = individuals[top_individual_index]
-        while len(next_generation) < self.total_filter_size:
-            top_individual_index = sorted_individual_indices[0]
-            top_individual = individuals[top_individual_index]
-            top_individual_family1 = top_individual_index[3:6]
-            top_individual_family2 = top_individual_index[6:9]
-            if top_individual_family1 not in family_counts:
-                family_counts[top_individual_family1] = 0
-            if top_individual_family2 not in family_counts:
-                family_counts[top_individual_family2] = 0
-            if family_counts[top_individual_family1] > self.family_filter_size or family_counts[top_individual_family2] > self.family_filter_size:
-                sorted_individual_indices.remove(top_individual_index)
-            else:
-                family_counts[top_individual_family1] += 1
-                family_counts[top_individual_family2] += 1
-                next_generation[top_individual_index] = top_individual
-                sorted_individual_indices.remove(top_individual_index)
-        genome_file_name = "./data/output/rip/genome_{}_{}.pygenome".format(generation, top_individual_index)
-        with open(genome_file_name, "wb") as fp:
-            pickle.dump(top_individual.genome, fp)
+        survivors = selection.select_survivors(individuals.rows['fitness'], individuals.rows['family1'], individuals.rows['family2'], self.total_filter_size, self.family_filter_size)
+        self.parents = individuals.take(survivors) | new_members
+
+    def produce_random_members(self, generation):
         new_members = {}
         for random_member_index in range(self.random_members):
-            new_individual_key = self.generation_size + (generation * self.random_members) + random_member_index
-            new_id = f"{generation:03}" + f"{new_individual_key:03}" + f"{new_individual_key:03}" + f"{random_member_index:03}"
+            new_id = self.random_member_id(generation, random_member_index)
             new_members[new_id] = Solution(solution_id=new_id)
-        self.evaluate(new_members)
-        self.parents = next_generation | new_members
+        return PopulationTable(new_members)
+
+    def random_member_id(self, generation, random_member_index):
+        # each random member starts a family of its own
+        new_family = self.generation_size + (generation * self.random_members) + random_member_index
+        return pack_solution_id(generation, new_family, new_family, random_member_index)
 
     def show_best(self) -> None:
         individuals = self.children | self.parents
-        sorted_individual_indices = self.sort_individuals(individuals)
-        top_individual_index = sorted_individual_indices[0]
-        top_individual = individuals[top_individual_index]
+        top_individual = individuals.solutions[individuals.fittest_first()[0]]
 
         now = datetime.now()
         date_time_str = now.strftime("%Y-%m-%d.%H_%M_%S_%f")
         fitness_file_name = "./data/output/fitnesses_{}.pylist".format(date_time_str)
         with open(fitness_file_name, "wb") as fp:
             pickle.dump(self.max_fitnesses, fp)
-        genome_file_name = "./data/output/genome_{}.pygenome".format(date_time_str)
-        with open(genome_file_name, "wb") as fp:
-            pickle.dump(top_individual.genome, fp)
+        fitness_curve_file_name = "./data/output/fitness_curve_{}.pylist".format(date_time_str)
+        with open(fitness_curve_file_name, "wb") as fp:
+            pickle.dump(self.fitness_curve, fp)
+        genome_file_name = "./data/output/genome_{}{}".format(date_time_str, genome_format.GENOME_FILE_EXTENSION)
+        genome_format.save_genome(top_individual.genome, genome_file_name)
 
         return genome_file_name, fitness_file_name
 
-    def sort_individuals(self, individuals):
-        individual_fitness_dict = {}
-        for individual in individuals:
-            individual_fitness_dict[individual] = individuals[individual].fitness
-        return merge_sort.merge_sort(individual_fitness_dict)
+    def worst_fitness(self, individuals):
+        return individuals.rows['fitness'].min()
@@ -1,18 +1,19 @@
-import copy
 from datetime import datetime
 import os
 import pickle
 import random
 
 import numpy as np
-import merge_sort
 from solution import Solution
+import selection
+from population_table import PopulationTable
+from solution_ids import pack_solution_id, family_of, format_solution_id
 import constants as Cnsts
 
-import body_builder
 import body_mutator
 import brain_mutator
 from body_parts import *
+import genome_format
 
 import multiprocessing as mp
 
@@ -24,7 +25,6 @@ class FAERYvPyrCor1NoP:
     def __init__(self) -> None:
         os.system("rm ./data/robot/brain*.nndf")
         os.system("rm ./data/robot/body*.urdf")
-        self.parents = {}
         self.next_available_id = 0
 
         self.generation_size = Cnsts.generation_size
@@ -33,10 +33,12 @@ class FAERYvPyrCor1NoP:
         self.random_members = Cnsts.random_members
         self.total_filter_size = self.generation_size - self.random_members
 
+        parents = {}
         for parent_num in range(Cnsts.generation_size):
-            parent_id = "000" + f"{parent_num:03}" + f"{parent_num:03}" + "000"
-            self.parents[parent_id] = Solution(solution_id=parent_id)
+            parent_id = pack_solution_id(0, parent_num, parent_num, 0)
+            parents[parent_id] = Solution(solution_id=parent_id)
             self.next_available_id += 1
+        self.parents = PopulationTable(parents)
         
         self.rng = np.random.default_rng()
         self.max_fitnesses = []
@@ -54,7 +56,7 @@ class FAERYvPyrCor1NoP:
     def evaluate(self, solutions) -> None:
         for solution in solutions.values():
             result = self.run_simulation(solution)
-            solutions[result[0]].set_fitness(result[1])
+            solutions.set_fitness(result[0], result[1])
 
     def run_simulation(self, solution):
         solution_fitness = solution.start_simulation()
@@ -67,46 +69,25 @@ class FAERYvPyrCor1NoP:
         self.select(generation)
 
     def produce_children(self, generation):
-        self.children = {}
+        children = {}
+        family_child_counts = {}
         for parent in self.parents:
+            family = family_of(parent)
             for child_num in range(self.number_of_children):
-                child_id = f"{generation+1:03}" + parent[3:6] + parent[3:6] + f"{child_num:03}"
-                child_body_chromosone, child_brain_chromosome, child_bodycons_id = self.mutate(copy.deepcopy(self.parents[parent].genome), child_id)
+                child_id = pack_solution_id(generation + 1, family, family, family_child_counts.get(family, 0))
+                family_child_counts[family] = family_child_counts.get(family, 0) + 1
+                child_body_chromosone, child_brain_chromosome, child_bodycons_id = self.mutate(self.parents[parent].genome, child_id)
                 child_genome = Genome(child_bodycons_id, child_brain_chromosome, child_body_chromosone)
-                self.children[child_id] = Solution(child_id, child_genome)
+                children[child_id] = Solution(child_id, child_genome)
+        self.children = PopulationTable(children)
 
     def mutate(self, genome_to_mutate, genome_id):
-        running = True
-
-        while running:
-            try:
-                mutated_body_chromosome, new_bodycons_id = body_mutator.mutate(genome_to_mutate.body_chromosome, genome_to_mutate.bodycons_id)
-
-                psz.Start_URDF("./data/robot/body{}.urdf".format(genome_id))
-
-                body_builder.build_body(mutated_body_chromosome)
-
-                psz.end()
-
-                running = False
-
-            except:
-                psz.end()
-                os.system("rm ./data/robot/body{}.urdf".format(genome_id))
-                print("invalid body plan, retrying")
-        
-        os.system("rm ./data/robot/body{}.urdf".format(genome_id))
+        mutated_body_chromosome, new_bodycons_id = body_mutator.mutate(genome_to_mutate.body_chromosome, genome_to_mutate.bodycons_id)
 
         if genome_to_mutate.brain_chromosome is not None:
             mutated_brain_chromosome_weights = brain_mutator.mutate(genome_to_mutate.brain_chromosome, self.rng, genome_to_mutate.brain_chromosome.shape, Cnsts.mutation_rate, Cnsts.mutation_magnitude)
 
-            mutated_brain_chromosome = NeuronWeightMatrix(
-                sensor_neurons=list(genome_to_mutate.brain_chromosome.get_sensors().keys()),
-                motor_neurons=list(genome_to_mutate.brain_chromosome.get_motors().keys()),
-                previous_weights=None
-            )
-
-            mutated_brain_chromosome.set_weights(mutated_brain_chromosome_weights)
+            mutated_brain_chromosome = genome_to_mutate.brain_chromosome.with_weights(mutated_brain_chromosome_weights)
         else:
             mutated_brain_chromosome = None
         
@@ -114,13 +95,8 @@ class FAERYvPyrCor1NoP:
 
 
     def print(self) -> None:
-        parent_fitnesses = []
-        for key in self.parents:
-            parent_fitnesses.append(self.parents[key].fitness)
-
-        child_fitnesses = []
-        for key in self.children:
-            child_fitnesses.append(self.children[key].fitness)
+        parent_fitnesses = self.parents.rows['fitness']
+        child_fitnesses = self.children.rows['fitness']
 
         print("\np max: {} \t\t c max: {}".format(np.max(parent_fitnesses), np.max(child_fitnesses)))
         print("p mean: {} \t\t c mean: {}\n".format(np.mean(parent_fitnesses), np.mean(child_fitnesses)))
@@ -128,57 +104,30 @@ class FAERYvPyrCor1NoP:
 
     def select(self, generation) -> None:
         individuals = self.children | self.parents
-        sorted_individual_indices = self.sort_individuals(individuals)
-        next_generation = {}
-        family_counts = {}
-        top_individual_index = sorted_individual_indices[0]
-        top_individual = individuals[top_individual_index]
-        while len(next_generation) < self.total_filter_size:
-            top_individual_index = sorted_individual_indices[0]
-            top_individual = individuals[top_individual_index]
-            top_individual_family1 = top_individual_index[3:6]
-            top_individual_family2 = top_individual_index[6:9]
-            if top_individual_family1 not in family_counts:
-                family_counts[top_individual_family1] = 0
-            if top_individual_family2 not in family_counts:
-                family_counts[top_individual_family2] = 0
-            if family_counts[top_individual_family1] > self.family_filter_size or family_counts[top_individual_family2] > self.family_filter_size:
-                sorted_individual_indices.remove(top_individual_index)
-            else:
-                family_counts[top_individual_family1] += 1
-                family_counts[top_individual_family2] += 1
-                next_generation[top_individual_index] = top_individual
-                sorted_individual_indices.remove(top_individual_index)
-        genome_file_name = "./data/output/rip/genome_{}_{}.pygenome".format(generation, top_individual_index)
-        with open(genome_file_name, "wb") as fp:
-            pickle.dump(top_individual.genome, fp)
+        survivors = selection.select_survivors(individuals.rows['fitness'], individuals.rows['family1'], individuals.rows['family2'], self.total_filter_size, self.family_filter_size)
+        next_generation = individuals.take(survivors)
+        top_individual_id = int(next_generation.rows['solution_id'][-1])
+        genome_file_name = "./data/output/rip/genome_{}_{}{}".format(generation, format_solution_id(top_individual_id), genome_format.GENOME_FILE_EXTENSION)
+        genome_format.save_genome(next_generation[top_individual_id].genome, genome_file_name)
         new_members = {}
         for random_member_index in range(self.random_members):
-            new_individual_key = self.generation_size + (generation * self.random_members) + random_member_index
-            new_id = f"{generation:03}" + f"{new_individual_key:03}" + f"{new_individual_key:03}" + f"{random_member_index:03}"
+            new_family = self.generation_size + (generation * self.random_members) + random_member_index
+            new_id = pack_solution_id(generation, new_family, new_family, random_member_index)
             new_members[new_id] = Solution(solution_id=new_id)
+        new_members = PopulationTable(new_members)
         self.evaluate(new_members)
         self.parents = next_generation | new_members
 
     def show_best(self) -> None:
         individuals = self.children | self.parents
-        sorted_individual_indices = self.sort_individuals(individuals)
-        top_individual_index = sorted_individual_indices[0]
-        top_individual = individuals[top_individual_index]
+        top_individual = individuals.solutions[individuals.fittest_first()[0]]
 
         now = datetime.now()
         date_time_str = now.strftime("%Y-%m-%d.%H_%M_%S_%f")
         fitness_file_name = "./data/output/fitnesses_{}.pylist".format(date_time_str)
         with open(fitness_file_name, "wb") as fp:
             pickle.dump(self.max_fitnesses, fp)
-        genome_file_name = "./data/output/genome_{}.pygenome".format(date_time_str)
-        with open(genome_file_name, "wb") as fp:
-            pickle.dump(top_individual.genome, fp)
+        genome_file_name = "./data/output/genome_{}{}".format(date_time_str, genome_format.GENOME_FILE_EXTENSION)
+        genome_format.save_genome(top_individual.genome, genome_file_name)
 
         return genome_file_name, fitness_file_name
-
-    def sort_individuals(self, individuals):
-        individual_fitness_dict = {}
-        for individual in individuals:
-            individual_fitness_dict[individual] = individuals[individual].fitness
-        return merge_sort.merge_sort(individual_fitness_dict)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+from collections import OrderedDict
+import hashlib
+import os
+import shelve
+from typing import Union
+
+import numpy as np
+from body_parts import *
+import constants as Cnsts
+
+# bumped whenever a hash stops meaning the same robot or a fitness stops meaning the same thing,
+# so shelves written under the old meaning are never read; 2: genomes without a brain get the one
+# brain_random_state builds from their hash; 3: body plans hash as a flat list of parts
+FITNESS_CACHE_VERSION = 3
+
+def canonical_body_plan(body_plan: BodyCons) -> bytes:
+    # bodycons ids only name parts, and the order of next_body_plans does not change the body,
+    # so neither takes part in the canonical form. Parts are written depth first, children in
+    # direction order, each with the direction it hangs off and how many parts hang off it;
+    # walked with a stack, like compile_body, so deep plans hash without recursion
+    records = []
+    plans_to_write = [(None, body_plan)]
+    while plans_to_write:
+        direction, current_plan = plans_to_write.pop()
+        build_specifications = current_plan.build_specifications[0]
+        next_body_plans = current_plan.next_body_plans if current_plan.next_body_plans is not None else {}
+
+        records.append(repr((
+            direction,
+            type(current_plan.body_part).__name__,
+            build_specifications.direction_to_build.value,
+            build_specifications.repitions,
+            tuple(build_specifications.axis.value),
+            tuple(float(dimension) for dimension in part_dimensions(current_plan)),
+            len(next_body_plans))))
+
+        plans_to_write.extend(sorted(((next_direction.value, next_body_plan) for next_direction, next_body_plan in next_body_plans.items()), key=lambda item: item[0], reverse=True))
+
+    return "\n".join(records).encode()
+
+def canonical_brain(brain_chromosome: Union[NeuronWeightMatrix, None]) -> bytes:
+    if brain_chromosome is None:
+        return b"random"
+
+    sensors = sorted(brain_chromosome.get_sensors())
+    motors = sorted(brain_chromosome.get_motors())
+    sensor_indices = [brain_chromosome.get_sensors()[sensor] for sensor in sensors]
+    motor_indices = [brain_chromosome.get_motors()[motor] for motor in motors]
+    weights = np.ascontiguousarray(brain_chromosome.get_weights()[np.ix_(sensor_indices, motor_indices)], dtype="<f8")
+
+    return repr((sensors, motors)).encode() + weights.tobytes()
+
+def genome_hash(genome: Genome) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(canonical_body_plan(genome.body_chromosome))
+    digest.update(canonical_brain(genome.brain_chromosome))
+    return digest.hexdigest()
+
+
+class FitnessCache:
+    # Bounded LRU of genome hash -> fitness, backed by an on-disk shelf so hits carry across runs.
+    # The same genome scores differently under other simulation settings, so keys carry the settings
+    # they were simulated with and a run only ever sees fitnesses from runs simulated like it
+
+    def __init__(self, capacity: int = Cnsts.fitness_cache_size, store_file: Union[str, None] = Cnsts.fitness_cache_file, control_period: int = Cnsts.control_period, num_iterations: int = Cnsts.num_iterations) -> None:
+        self.capacity = capacity
+        self.key_prefix = "c{}.n{}:".format(control_period, num_iterations)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.store = None
+        if store_file is not None:
+            os.makedirs(os.path.dirname(store_file), exist_ok=True)
+            self.store = shelve.open("{}.v{}".format(store_file, FITNESS_CACHE_VERSION))
+
+    def get(self, key: str) -> Union[float, None]:
+        key = self.key_prefix + key
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.store is not None and key in self.store:
+            fitness = self.store[key]
+            self.remember(key, fitness)
+            self.hits += 1
+            return fitness
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, fitness: float) -> None:
+        key = self.key_prefix + key
+        self.remember(key, fitness)
+        if self.store is not None:
+            self.store[key] = fitness
+
+    def remember(self, key: str, fitness: float) -> None:
+        # key as stored, with its settings prefix; checkpoints save and restore entries this way
+        self.entries[key] = fitness
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def close(self) -> None:
+        if self.store is not None:
+            self.store.close()
+            self.store = None
@@ -0,0 +1,270 @@
+from __future__ import annotations
+import argparse
+import mmap
+import os
+from typing import Iterator, Union
+
+from collections import OrderedDict
+import numpy as np
+from body_parts import *
+import genome_format
+from solution_ids import solution_id_fields, format_solution_id, parse_solution_id
+import constants as Cnsts
+
+# One archive per run: every evaluated genome is appended as a PRIF record to the archive file,
+# and a row for it is appended to an index file next to it. Index rows are fixed size, so the
+# whole index loads in one read and queries are numpy operations on its columns;
+# genomes are decoded straight out of a memory map of the archive.
+# Both files are only ever appended to, and the index is written after the records it points
+# at, so a run that dies mid-write leaves at most a partial last record that nothing points to.
+# Children can be stored as deltas against their parent's record. Along every lineage a full
+# record is written at least every snapshot_interval generations, so rebuilding a genome never
+# decodes more than that many records.
+
+INDEX_EXTENSION = ".idx"
+
+INDEX_DTYPE = np.dtype([
+    ('solution_id', '<u8'),
+    ('generation',  '<i4'),
+    ('family1',     '<i4'),
+    ('family2',     '<i4'),
+    ('fitness',     '<f8'),
+    ('offset',      '<u8'),
+    ('length',      '<u4'),
+    ('chain',       '<u2'),
+    ('parent_row',  '<i8')
+])
+
+DECODED_GENOMES_CACHE_SIZE = 256
+
+def index_file_name(archive_file_name: str) -> str:
+    return archive_file_name + INDEX_EXTENSION
+
+class GenomeArchiveWriter:
+
+    def __init__(self, file_name: str, snapshot_interval: int = Cnsts.archive_snapshot_interval) -> None:
+        self.file_name = file_name
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        self.archive = open(file_name, "ab")
+        self.index = open(index_file_name(file_name), "ab")
+        self.read_latest_rows(os.path.getsize(index_file_name(file_name)) // INDEX_DTYPE.itemsize)
+
+    def read_latest_rows(self, records: int) -> None:
+        # solution id -> (row, chain) of its latest record, for children to be stored against
+        index = np.fromfile(index_file_name(self.file_name), dtype=INDEX_DTYPE, count=records)
+        self.latest_rows = { solution_id: (row, chain) for row, (solution_id, chain) in enumerate(zip(index['solution_id'].tolist(), index['chain'].tolist())) }
+        self.records = records
+
+    def append(self, generation: int, solutions, parents=None) -> None:
+        # solutions: solution id -> Solution with a fitness; parents: solution id -> the Solution it
+        # was bred from, for those to be stored as deltas. Written as one block per call
+        parents = parents if parents is not None else {}
+        parent_subtrees = {}
+
+        offset = self.archive.tell()
+        records = []
+        rows = []
+        for solution_id, solution in solutions.items():
+            parent = parents.get(solution_id)
+            parent_row, parent_chain = self.latest_rows.get(parent.solution_id, (-1, 0)) if parent is not None else (-1, 0)
+
+            if parent_row >= 0 and parent_chain + 1 < self.snapshot_interval:
+                if parent.solution_id not in parent_subtrees:
+                    parent_subtrees[parent.solution_id] = genome_format.index_subtrees(parent.genome.body_chromosome)
+                record = genome_format.encode_genome(solution.genome, parent.genome, parent_subtrees[parent.solution_id])
+                chain = parent_chain + 1
+            else:
+                record = genome_format.encode_genome(solution.genome)
+                parent_row, chain = -1, 0
+
+            rows.append((solution_id, generation, 0, 0, solution.fitness, offset, len(record), chain, parent_row))
+            records.append(record)
+            offset += len(record)
+
+        index_rows = np.array(rows, dtype=INDEX_DTYPE)
+        _, index_rows['family1'], index_rows['family2'], _ = solution_id_fields(index_rows['solution_id'])
+
+        self.archive.write(b"".join(records))
+        self.archive.flush()
+        self.index.write(index_rows.tobytes())
+        self.index.flush()
+
+        for row, (solution_id, *fields, chain, parent_row) in enumerate(rows, self.records):
+            self.latest_rows[solution_id] = (row, chain)
+        self.records += len(rows)
+
+    def truncate(self, records: int) -> None:
+        # drops everything after the first records rows, e.g. what a crashed run wrote after its last checkpoint
+        index = np.fromfile(index_file_name(self.file_name), dtype=INDEX_DTYPE, count=records)
+        end = int(index['offset'][records - 1] + index['length'][records - 1]) if records > 0 else 0
+        # truncate leaves the position of an append handle at the old end, and append takes offsets from it
+        self.archive.truncate(end)
+        self.archive.seek(end)
+        self.index.truncate(records * INDEX_DTYPE.itemsize)
+        self.index.seek(records * INDEX_DTYPE.itemsize)
+        self.read_latest_rows(records)
+
+    def close(self) -> None:
+        self.archive.close()
+        self.index.close()
+
+
+class GenomeArchive:
+    # read side: the index as it was when the archive was opened, and a memory map of the records
+
+    def __init__(self, file_name: str) -> None:
+        self.file_name = file_name
+        with open(index_file_name(file_name), "rb") as fp:
+            index_bytes = fp.read()
+        self.index = np.frombuffer(index_bytes, dtype=INDEX_DTYPE, count=len(index_bytes) // INDEX_DTYPE.itemsize)
+
+        self.data = b""
+        if os.path.getsize(file_name) > 0:
+            with open(file_name, "rb") as fp:
+                self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.generation_order = np.argsort(self.index['generation'], kind='stable')
+        self.solution_rows = None
+        self.decoded_genomes = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def genome(self, row: int) -> Genome:
+        # deltas are applied from the nearest full record (or genome decoded recently) down to row;
+        # where weights were stored whole they are a view of the memory map, not copied out of the file
+        parent_rows = self.index['parent_row']
+        rows_to_decode = [row]
+        while parent_rows[rows_to_decode[-1]] >= 0 and rows_to_decode[-1] not in self.decoded_genomes:
+            rows_to_decode.append(int(parent_rows[rows_to_decode[-1]]))
+
+        genome = self.decoded_genomes.get(rows_to_decode[-1])
+        if genome is not None:
+            self.decoded_genomes.move_to_end(rows_to_decode.pop())
+
+        for row_to_decode in reversed(rows_to_decode):
+            genome = genome_format.decode_genome(self.data, int(self.index['offset'][row_to_decode]), genome)[0]
+            self.decoded_genomes[row_to_decode] = genome
+            while len(self.decoded_genomes) > DECODED_GENOMES_CACHE_SIZE:
+                self.decoded_genomes.popitem(last=False)
+
+        return genome
+
+    def genomes(self, rows) -> Iterator[Genome]:
+        for row in rows:
+            yield self.genome(row)
+
+    def find(self, solution_id: int) -> Union[int, None]:
+        # row of solution_id; if it was archived more than once, its latest row
+        if self.solution_rows is None:
+            self.solution_rows = { solution_id: row for row, solution_id in enumerate(self.index['solution_id'].tolist()) }
+        return self.solution_rows.get(solution_id)
+
+    def generation_rows(self, first_generation: int, last_generation: Union[int, None] = None) -> np.ndarray:
+        # rows of generations first_generation to last_generation inclusive, in the order they were archived
+        last_generation = first_generation if last_generation is None else last_generation
+        generations = self.index['generation'][self.generation_order]
+        start, end = np.searchsorted(generations, [first_generation, last_generation + 1])
+        return self.generation_order[start:end]
+
+    def family_rows(self, family: int) -> np.ndarray:
+        return np.flatnonzero((self.index['family1'] == family) | (self.index['family2'] == family))
+
+    def top_rows(self, k: int, rows: Union[np.ndarray, None] = None) -> np.ndarray:
+        # the k fittest of rows (of the whole archive if rows is None), best first
+        rows = np.arange(len(self.index)) if rows is None else np.asarray(rows)
+        if k <= 0:
+            return rows[:0]
+        if k < len(rows):
+            rows = rows[np.argpartition(-self.index['fitness'][rows], k - 1)[:k]]
+        return rows[np.argsort(-self.index['fitness'][rows], kind='stable')]
+
+
+def check_truncate_append(file_name: str, generation_size: int = 4) -> None:
+    # writes two generations (the second as deltas), truncates back to the first the way a resumed run
+    # does, appends a different second generation through the same writer, and checks every record
+    # written reads back as the genome it was written from
+    from solution import Solution
+    from solution_ids import pack_solution_id
+    from fitness_cache import genome_hash
+
+    for stale_file in (file_name, index_file_name(file_name)):
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
+
+    def generation(number, parents):
+        solutions = {}
+        bred_from = {}
+        for family in range(generation_size):
+            solution_id = pack_solution_id(number, family, family, 0)
+            parent = parents.get(family)
+            solutions[solution_id] = Solution(solution_id, parent.genome if parent is not None else None)
+            if parent is not None:
+                solutions[solution_id].mutate_body()
+                bred_from[solution_id] = parent
+            solutions[solution_id].set_fitness(float(number * generation_size + family))
+        return solutions, bred_from
+
+    first, _ = generation(0, {})
+    parents = { family: solution for family, solution in enumerate(first.values()) }
+
+    writer = GenomeArchiveWriter(file_name)
+    writer.append(0, first)
+    writer.append(1, *generation(1, parents))
+    writer.truncate(len(first))
+    second, bred_from = generation(1, parents)
+    writer.append(1, second, bred_from)
+    writer.close()
+
+    written = first | second
+    archive = GenomeArchive(file_name)
+    assert len(archive) == len(written), "{} records after truncating and appending, expected {}".format(len(archive), len(written))
+    assert os.path.getsize(file_name) == int(archive.index['offset'][-1] + archive.index['length'][-1]), "archive does not end with its last record"
+    assert (archive.index['offset'][1:] == archive.index['offset'][:-1] + archive.index['length'][:-1]).all(), "records are not back to back"
+    for row, solution_id in enumerate(archive.index['solution_id'].tolist()):
+        assert genome_hash(archive.genome(row)) == genome_hash(written[solution_id].genome), "record {} does not read back as {}".format(row, format_solution_id(solution_id))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog = 'genome_archive.py',
+        description = 'Lists the fittest genomes in a run archive, and extracts genomes from it.')
+    parser.add_argument('file')
+    parser.add_argument('-k', '--top', type=int, default=10)
+    parser.add_argument('-g', '--generation', type=int, default=None)
+    parser.add_argument('-f', '--family', type=int, default=None)
+    parser.add_argument('-x', '--extract', nargs='+', type=parse_solution_id, default=None, help='solution ids (generation.family1.family2.child) to write out as genome files')
+    parser.add_argument('--check', action='store_true', help='overwrites file with a scratch archive and checks it reads back after being truncated and appended to')
+
+    args = parser.parse_args()
+
+    if args.check:
+        check_truncate_append(args.file)
+        print("{} reads back after truncating and appending".format(args.file))
+        exit()
+
+    archive = GenomeArchive(args.file)
+
+    if args.extract is not None:
+        for solution_id in args.extract:
+            row = archive.find(solution_id)
+            if row is None:
+                print("{} is not in {}".format(format_solution_id(solution_id), args.file))
+                continue
+            genome_file_name = "./data/output/genome_{}{}".format(format_solution_id(solution_id), genome_format.GENOME_FILE_EXTENSION)
+            genome_format.save_genome(archive.genome(row), genome_file_name)
+            print(genome_file_name)
+        exit()
+
+    rows = None
+    if args.generation is not None:
+        rows = archive.generation_rows(args.generation)
+    if args.family is not None:
+        family_rows = archive.family_rows(args.family)
+        rows = family_rows if rows is None else np.intersect1d(rows, family_rows)
+
+    print("{} genomes in {}".format(len(archive), args.file))
+    for row in archive.top_rows(args.top, rows):
+        entry = archive.index[row]
+        print("{} \t generation: {} \t fitness: {}".format(format_solution_id(int(entry['solution_id'])), entry['generation'], entry['fitness']))
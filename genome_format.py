@@ -0,0 +1,368 @@
+from __future__ import annotations
+import argparse
+import os
+import pickle
+import struct
+from typing import BinaryIO, Iterator, NamedTuple, Union
+
+import numpy as np
+from body_parts import *
+
+# PRIF genome records: a fixed header, one row per BodyCons in depth first order, the brain's
+# neuron names and its weights. Part types, directions and axes are stored as their index in
+# PART_CLASSES, CUBE_ELEMENTS_ORDER and AXES_ORDER, so renaming a class does not break old files.
+# Records can be written back to back into one stream; each header carries the record's length.
+# Everything is little endian, and the weights start on an 8 byte boundary so they load with
+# np.frombuffer straight out of the record without a copy.
+# A record can also be a delta against a parent genome: every subtree it shares with the parent
+# is a single reference row, the neuron names are left out when they are the parent's, and when
+# few weights changed only those are stored. Deltas decode only with the parent at hand.
+
+GENOME_MAGIC = b"PRIF"
+GENOME_FORMAT_VERSION = 2
+# version 1 records are version 2 records that are never deltas
+READABLE_VERSIONS = (1, 2)
+GENOME_FILE_EXTENSION = ".prif"
+
+# magic, version, flags, record length, bodycons id, nodes, sensors, motors, neuron name bytes
+HEADER = struct.Struct("<4sHHIqIIII")
+WEIGHT_DELTA_COUNT = struct.Struct("<Q")
+
+HAS_BRAIN = 1
+DELTA = 2
+SAME_NEURONS = 4
+WEIGHT_DELTA = 8
+
+HAS_DIMENSIONS = 1
+HAS_NEXT_BODY_PLANS = 2
+# a subtree shared with the parent; body_cons_id holds its row in the parent's table
+REFERENCE = 4
+ROOT_DIRECTION = 255
+
+NODE_DTYPE = np.dtype([
+    ('body_cons_id',    '<i8'),
+    ('dimensions',      '<f8', (3,)),
+    ('repitions',       '<i4'),
+    ('child_count',     '<u2'),
+    ('part_type',       'u1'),
+    ('direction',       'u1'),
+    ('axis',            'u1'),
+    ('next_direction',  'u1'),
+    ('flags',           'u1'),
+    ('padding',         'u1')
+])
+
+class GenomeHeader(NamedTuple):
+    version:            int
+    flags:              int
+    record_length:      int
+    bodycons_id:        int
+    node_count:         int
+    sensor_count:       int
+    motor_count:        int
+    neuron_name_bytes:  int
+
+class ParentSubtrees(NamedTuple):
+    subtree_numbers:    dict[tuple, int]
+    subtree_rows:       dict[int, int]
+
+def aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def encode_body_plan(body_plan: BodyCons) -> np.ndarray:
+    rows = []
+    plans_to_encode = [(body_plan, ROOT_DIRECTION)]
+    while plans_to_encode:
+        current_plan, next_direction = plans_to_encode.pop()
+        build_specifications = current_plan.build_specifications[0]
+
+        flags = 0
+        dimensions = (0.0, 0.0, 0.0)
+        if current_plan.dimensions is not None:
+            flags |= HAS_DIMENSIONS
+            dimensions = tuple(current_plan.dimensions)
+
+        next_body_plans = ()
+        if current_plan.next_body_plans is not None:
+            flags |= HAS_NEXT_BODY_PLANS
+            next_body_plans = list(current_plan.next_body_plans.items())
+
+        rows.append((current_plan.body_cons_id, dimensions, build_specifications.repitions, len(next_body_plans),
+                     PART_CLASSES.index(type(current_plan.body_part)), CUBE_ELEMENT_TAGS[build_specifications.direction_to_build],
+                     AXIS_TAGS[build_specifications.axis], next_direction, flags, 0))
+
+        for direction, next_body_plan in reversed(next_body_plans):
+            plans_to_encode.append((next_body_plan, CUBE_ELEMENT_TAGS[direction]))
+
+    return np.array(rows, dtype=NODE_DTYPE)
+
+def table_order_plans(body_plan: BodyCons) -> list[BodyCons]:
+    # the plan's BodyCons in the order encode_body_plan writes their rows
+    body_plans = []
+    plans_to_list = [body_plan]
+    while plans_to_list:
+        current_plan = plans_to_list.pop()
+        body_plans.append(current_plan)
+        if current_plan.next_body_plans is not None:
+            plans_to_list.extend(reversed(list(current_plan.next_body_plans.values())))
+    return body_plans
+
+def number_subtrees(nodes: np.ndarray, subtree_numbers: dict[tuple, int], add_new: bool) -> tuple[list[int], list[int]]:
+    # gives equal subtrees equal numbers, bottom up so each subtree is hashed once, and counts their
+    # rows; without add_new, subtrees not already in subtree_numbers get a number of their own
+    rows = nodes.tolist()
+    numbers = [0] * len(rows)
+    sizes = [1] * len(rows)
+    numbered = []
+    for row in range(len(rows) - 1, -1, -1):
+        body_cons_id, dimensions, repitions, child_count, part_type, direction, axis, next_direction, flags, padding = rows[row]
+        child_rows = [numbered.pop() for child in range(child_count)]
+
+        key = (body_cons_id, tuple(dimensions), repitions, part_type, direction, axis, flags, tuple((rows[child][7], numbers[child]) for child in child_rows))
+        if add_new:
+            numbers[row] = subtree_numbers.setdefault(key, len(subtree_numbers))
+        else:
+            numbers[row] = subtree_numbers.get(key, -1 - row)
+        sizes[row] = 1 + sum(sizes[child] for child in child_rows)
+        numbered.append(row)
+
+    return numbers, sizes
+
+def index_subtrees(parent_body_plan: BodyCons) -> ParentSubtrees:
+    # worth keeping when several children are encoded against the same parent
+    subtree_numbers = {}
+    numbers, sizes = number_subtrees(encode_body_plan(parent_body_plan), subtree_numbers, True)
+
+    subtree_rows = {}
+    for row, number in enumerate(numbers):
+        subtree_rows.setdefault(number, row)
+    return ParentSubtrees(subtree_numbers, subtree_rows)
+
+def encode_body_plan_delta(body_plan: BodyCons, parent_subtrees: ParentSubtrees) -> np.ndarray:
+    nodes = encode_body_plan(body_plan)
+    numbers, sizes = number_subtrees(nodes, parent_subtrees.subtree_numbers, False)
+
+    kept_rows = []
+    reference_rows = []
+    row = 0
+    while row < len(nodes):
+        if numbers[row] in parent_subtrees.subtree_rows:
+            reference_rows.append((len(kept_rows), parent_subtrees.subtree_rows[numbers[row]]))
+            kept_rows.append(row)
+            row += sizes[row]
+        else:
+            kept_rows.append(row)
+            row += 1
+
+    delta_nodes = nodes[kept_rows]
+    for delta_row, parent_row in reference_rows:
+        next_direction = delta_nodes['next_direction'][delta_row]
+        delta_nodes[delta_row] = (parent_row, (0.0, 0.0, 0.0), 0, 0, 0, 0, 0, next_direction, REFERENCE, 0)
+    return delta_nodes
+
+def decode_body_plan(nodes: np.ndarray, parent_plans: Union[list[BodyCons], None] = None) -> BodyCons:
+    # children follow their parent in the table, so walking it backwards every node's children are
+    # already built and sit on top of the stack, first child uppermost
+    body_parts = [body_part_from_tag(tag) for tag in range(len(PART_CLASSES))]
+    build_specifications = {}
+
+    columns = zip(nodes['body_cons_id'].tolist(), nodes['dimensions'].tolist(), nodes['repitions'].tolist(), nodes['child_count'].tolist(),
+                  nodes['part_type'].tolist(), nodes['direction'].tolist(), nodes['axis'].tolist(), nodes['next_direction'].tolist(), nodes['flags'].tolist())
+
+    built = []
+    for body_cons_id, dimensions, repitions, child_count, part_type, direction, axis, next_direction, flags in reversed(list(columns)):
+        next_direction = CUBE_ELEMENTS_ORDER[next_direction] if next_direction != ROOT_DIRECTION else None
+
+        if flags & REFERENCE:
+            built.append((next_direction, parent_plans[body_cons_id]))
+            continue
+
+        next_body_plans = None
+        if flags & HAS_NEXT_BODY_PLANS:
+            next_body_plans = NextBodyPlans(built.pop() for child in range(child_count))
+
+        specification_record = (direction, repitions, axis)
+        if specification_record not in build_specifications:
+            build_specifications[specification_record] = build_specifications_from_record(direction, repitions, axis)
+
+        body_plan = BodyCons(body_cons_id, body_parts[part_type], [build_specifications[specification_record]], next_body_plans,
+                             Dimensions(*dimensions) if flags & HAS_DIMENSIONS else None)
+        built.append((next_direction, body_plan))
+
+    return built[0][1]
+
+def inherited_weights(sensors: list[str], motors: list[str], parent_brain: NeuronWeightMatrix) -> np.ndarray:
+    # the parent's weight for every sensor and motor pair the parent also has, nan for the rest
+    weights = np.full((len(sensors), len(motors)), np.nan)
+    parent_sensors = parent_brain.get_sensors()
+    parent_motors = parent_brain.get_motors()
+    shared_sensors = [(row, parent_sensors[sensor]) for row, sensor in enumerate(sensors) if sensor in parent_sensors]
+    shared_motors = [(column, parent_motors[motor]) for column, motor in enumerate(motors) if motor in parent_motors]
+
+    if shared_sensors and shared_motors:
+        rows, parent_rows = zip(*shared_sensors)
+        columns, parent_columns = zip(*shared_motors)
+        weights[np.ix_(rows, columns)] = parent_brain.get_weights()[np.ix_(parent_rows, parent_columns)]
+    return weights
+
+def encode_brain(brain_chromosome: NeuronWeightMatrix, parent_brain: Union[NeuronWeightMatrix, None]) -> tuple[int, bytes, bytes]:
+    # flags, neuron name block and weight block of a brain; against a parent, only the weights that
+    # differ from the parent's are stored, when that is smaller
+    sensors = list(brain_chromosome.get_sensors())
+    motors = list(brain_chromosome.get_motors())
+    weights = np.ascontiguousarray(brain_chromosome.get_weights(), dtype="<f8")
+
+    flags = HAS_BRAIN
+    neuron_names = "\n".join(sensors + motors).encode()
+    if parent_brain is None:
+        return flags, neuron_names, weights.tobytes()
+
+    if parent_brain.has_neurons(sensors, motors):
+        flags |= SAME_NEURONS
+        neuron_names = b""
+        parent_weights = parent_brain.get_weights()
+    else:
+        parent_weights = inherited_weights(sensors, motors, parent_brain)
+
+    changed = np.flatnonzero(weights != parent_weights).astype("<u4")
+    weight_delta = WEIGHT_DELTA_COUNT.pack(len(changed)) + changed.tobytes()
+    weight_delta = weight_delta.ljust(aligned(len(weight_delta)), b"\0") + weights.ravel()[changed].tobytes()
+    if len(weight_delta) < weights.nbytes:
+        return flags | WEIGHT_DELTA, neuron_names, weight_delta
+    return flags, neuron_names, weights.tobytes()
+
+def encode_genome(genome: Genome, parent_genome: Union[Genome, None] = None, parent_subtrees: Union[ParentSubtrees, None] = None) -> bytes:
+    # with a parent_genome, a delta against it
+    flags = 0
+    if parent_genome is not None:
+        flags |= DELTA
+        parent_subtrees = parent_subtrees if parent_subtrees is not None else index_subtrees(parent_genome.body_chromosome)
+        nodes = encode_body_plan_delta(genome.body_chromosome, parent_subtrees).tobytes()
+    else:
+        nodes = encode_body_plan(genome.body_chromosome).tobytes()
+
+    neuron_names = b""
+    weights = b""
+    sensor_count = motor_count = 0
+    if genome.brain_chromosome is not None:
+        sensor_count, motor_count = genome.brain_chromosome.shape
+        brain_flags, neuron_names, weights = encode_brain(genome.brain_chromosome, parent_genome.brain_chromosome if parent_genome is not None else None)
+        flags |= brain_flags
+
+    weights_offset = aligned(HEADER.size + len(nodes) + len(neuron_names))
+    record_length = aligned(weights_offset + len(weights))
+
+    record = bytearray(record_length)
+    HEADER.pack_into(record, 0, GENOME_MAGIC, GENOME_FORMAT_VERSION, flags, record_length, genome.bodycons_id,
+                     len(nodes) // NODE_DTYPE.itemsize, sensor_count, motor_count, len(neuron_names))
+    record[HEADER.size:HEADER.size + len(nodes)] = nodes
+    record[HEADER.size + len(nodes):HEADER.size + len(nodes) + len(neuron_names)] = neuron_names
+    record[weights_offset:weights_offset + len(weights)] = weights
+    return bytes(record)
+
+def read_header(buffer: Union[bytes, bytearray, memoryview], offset: int = 0) -> GenomeHeader:
+    magic, *fields = HEADER.unpack_from(buffer, offset)
+    if magic != GENOME_MAGIC:
+        raise ValueError("not a PRIF genome record")
+    header = GenomeHeader(*fields)
+    if header.version not in READABLE_VERSIONS:
+        raise ValueError("PRIF genome version {} is not supported, expected one of {}".format(header.version, READABLE_VERSIONS))
+    return header
+
+def decode_genome(buffer: Union[bytes, bytearray, memoryview], offset: int = 0, parent_genome: Union[Genome, None] = None) -> tuple[Genome, int]:
+    # returns the genome and the offset just past its record; unless only some weights were stored,
+    # the weight matrix is a read only view of buffer. Deltas need the genome they were encoded against
+    header = read_header(buffer, offset)
+    if header.flags & DELTA and parent_genome is None:
+        raise ValueError("PRIF genome record is a delta and needs its parent genome")
+
+    nodes_offset = offset + HEADER.size
+    nodes = np.frombuffer(buffer, dtype=NODE_DTYPE, count=header.node_count, offset=nodes_offset)
+    body_plan = decode_body_plan(nodes, table_order_plans(parent_genome.body_chromosome) if header.flags & DELTA else None)
+
+    brain_chromosome = None
+    if header.flags & HAS_BRAIN:
+        names_offset = nodes_offset + header.node_count * NODE_DTYPE.itemsize
+        weights_offset = aligned(names_offset + header.neuron_name_bytes - offset) + offset
+
+        if header.flags & SAME_NEURONS:
+            sensors = list(parent_genome.brain_chromosome.get_sensors())
+            motors = list(parent_genome.brain_chromosome.get_motors())
+        else:
+            neuron_names = bytes(buffer[names_offset:names_offset + header.neuron_name_bytes]).decode().split("\n") if header.neuron_name_bytes > 0 else []
+            sensors = neuron_names[:header.sensor_count]
+            motors = neuron_names[header.sensor_count:]
+
+        if header.flags & WEIGHT_DELTA:
+            if header.flags & SAME_NEURONS:
+                weights = parent_genome.brain_chromosome.get_weights().copy()
+            else:
+                weights = inherited_weights(sensors, motors, parent_genome.brain_chromosome)
+            changed_count = WEIGHT_DELTA_COUNT.unpack_from(buffer, weights_offset)[0]
+            changed = np.frombuffer(buffer, dtype="<u4", count=changed_count, offset=weights_offset + WEIGHT_DELTA_COUNT.size)
+            values_offset = aligned(weights_offset + WEIGHT_DELTA_COUNT.size + changed.nbytes - offset) + offset
+            weights.ravel()[changed] = np.frombuffer(buffer, dtype="<f8", count=changed_count, offset=values_offset)
+        else:
+            weights = np.frombuffer(buffer, dtype="<f8", count=header.sensor_count * header.motor_count, offset=weights_offset)
+            weights = weights.reshape(header.sensor_count, header.motor_count)
+
+        if header.flags & SAME_NEURONS:
+            brain_chromosome = parent_genome.brain_chromosome.with_weights(weights)
+        else:
+            brain_chromosome = weight_matrix_from_record(sensors, motors, weights)
+
+    return Genome(header.bodycons_id, brain_chromosome, body_plan), offset + header.record_length
+
+def write_genome(fp: BinaryIO, genome: Genome) -> None:
+    fp.write(encode_genome(genome))
+
+def read_genome(fp: BinaryIO) -> Union[Genome, None]:
+    # the next genome in a stream, or None at its end
+    header_bytes = fp.read(HEADER.size)
+    if len(header_bytes) == 0:
+        return None
+    if len(header_bytes) < HEADER.size:
+        raise ValueError("truncated PRIF genome record")
+
+    header = read_header(header_bytes)
+    record = header_bytes + fp.read(header.record_length - HEADER.size)
+    if len(record) < header.record_length:
+        raise ValueError("truncated PRIF genome record")
+    return decode_genome(record)[0]
+
+def iterate_genomes(fp: BinaryIO) -> Iterator[Genome]:
+    genome = read_genome(fp)
+    while genome is not None:
+        yield genome
+        genome = read_genome(fp)
+
+def save_genome(genome: Genome, file_name: str) -> None:
+    with open(file_name, "wb") as fp:
+        write_genome(fp, genome)
+
+def load_genome(file_name: str) -> Genome:
+    # genomes saved before the PRIF format are pickles, and still load
+    with open(file_name, "rb") as fp:
+        data = fp.read()
+    if data[:len(GENOME_MAGIC)] == GENOME_MAGIC:
+        return decode_genome(data)[0]
+    return pickle.loads(data)
+
+def convert_pickled_genome(file_name: str) -> str:
+    # writes file_name's genome as a PRIF record next to it, with the PRIF extension
+    genome = load_genome(file_name)
+    converted_file_name = os.path.splitext(file_name)[0] + GENOME_FILE_EXTENSION
+    save_genome(genome, converted_file_name)
+    return converted_file_name
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog = 'genome_format.py',
+        description = 'Converts pickled .pygenome files into PRIF genome files.')
+    parser.add_argument('files', nargs='+')
+
+    args = parser.parse_args()
+
+    for file_name in args.files:
+        converted_file_name = convert_pickled_genome(file_name)
+        print("{} -> {} ({} -> {} bytes)".format(file_name, converted_file_name, os.path.getsize(file_name), os.path.getsize(converted_file_name)))
@@ -9,7 +9,7 @@ import constants as Cnsts
 
 solution_id = 0
 
-initial_body_plan = copy.deepcopy(BASE_BODYPLAN)
+initial_body_plan = BASE_BODYPLAN
 
 psz.Start_URDF("./data/robot/body{}.urdf".format(solution_id))
 
@@ -4,13 +4,26 @@ import pybullet as pblt
 from datetime import datetime
 import constants as c
 
+MAX_FORCE = 25
+
 class Motor:
 
-    def __init__(self, joint_name):
+    def __init__(self, joint_name, joint_index=None):
         self.joint_name = joint_name
-        self.max_force = 25
+        self.joint_index = joint_index
+        self.max_force = MAX_FORCE
 
     def set_value(self, robot, desired_angle):
+        if self.joint_index is not None:
+            pblt.setJointMotorControl2(
+                bodyIndex= robot.id,
+                jointIndex= self.joint_index,
+                controlMode= pblt.POSITION_CONTROL,
+                targetPosition= desired_angle * c.motor_joint_range,
+                force= self.max_force
+            )
+            return
+
         psz.Set_Motor_For_Joint(
                 bodyIndex= robot.id,
                 jointName= self.joint_name,
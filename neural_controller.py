@@ -0,0 +1,81 @@
+import numpy as np
+import pybullet as pblt
+import pyrosim_z as psz
+from body_parts import NeuronWeightMatrix
+import body_builder
+
+
+class NeuralController:
+    # Compiled, in-memory replacement for pyrosim's NEURAL_NETWORK, built straight from a NeuronWeightMatrix.
+    # Sensor values live in one array with a row per sensor part; a motor update is a single
+    # matrix-vector product followed by tanh, the same as NEURAL_NETWORK's per-neuron synapse walk.
+
+    def __init__(self, weight_matrix: NeuronWeightMatrix, joint_names: list[str], sensor_parts: list[str], link_names_to_indices: dict, joint_names_to_indices: dict) -> None:
+        self.sensor_links = [str(part_id) for part_id in sensor_parts]
+        self.motor_joints = list(joint_names)
+
+        sensor_rows = [weight_matrix.get_sensors()[body_builder.sensor_neuron_name(part_id)] for part_id in self.sensor_links]
+        motor_columns = [weight_matrix.get_motors()[body_builder.motor_neuron_name(joint_name)] for joint_name in self.motor_joints]
+        self.weights = np.ascontiguousarray(weight_matrix.get_weights()[np.ix_(sensor_rows, motor_columns)], dtype=float)
+
+        self.sensor_link_indices = np.array([link_names_to_indices[link_name] for link_name in self.sensor_links], dtype=int)
+        self.motor_joint_indices = np.array([joint_names_to_indices[joint_name] for joint_name in self.motor_joints], dtype=int)
+
+        self.sensor_values = np.zeros(len(self.sensor_links))
+        self.motor_values = np.zeros(len(self.motor_joints))
+
+    def update(self) -> np.ndarray:
+        np.tanh(self.sensor_values @ self.weights, out=self.motor_values)
+        return self.motor_values
+
+
+def check_nndf_parity(steps: int = 1000, tolerance: float = 1e-9, attempts: int = 100) -> float:
+    # drives a random robot that has brain parts through the URDF/NNDF path, and checks at every step
+    # that the compiled controller, given the same touch readings and the CPG signal on its brain rows
+    # as Robot.sense_touch gives it, produces the motor values NEURAL_NETWORK does
+    from solution import Solution
+    from robot import Robot, CPG_SIGNAL
+    import world
+
+    for attempt in range(attempts):
+        solution = Solution(solution_id="parity")
+        solution.generate_body()
+        if len(solution.body.brain_parts) > 0 and len(solution.joint_names) > 0:
+            break
+    assert len(solution.body.brain_parts) > 0, "no robot with brain parts in {} attempts".format(attempts)
+    solution.generate_body(export_files=True)
+    solution.generate_brain(export_files=True)
+
+    pblt.connect(pblt.DIRECT)
+    world.World()
+    reference = Robot(solution.solution_id)
+
+    link_names_to_indices = psz.get_link_names_to_indices()
+    controller = NeuralController(solution.weight_matrix, solution.joint_names, solution.sensor_parts, link_names_to_indices, psz.get_joint_names_to_indices())
+    brain_rows = np.array([row for row, link_name in enumerate(controller.sensor_links) if link_name in solution.body.brain_parts], dtype=int)
+    assert len(brain_rows) > 0, "robot has brain parts but none of them is a sensor row"
+
+    largest_difference = 0.0
+    for iteration in range(min(steps, len(CPG_SIGNAL))):
+        pblt.stepSimulation()
+
+        reference.sense(iteration)
+        controller.sensor_values[:] = [psz.Get_Touch_Sensor_Value_For_Link(link_name) for link_name in controller.sensor_links]
+        controller.sensor_values[brain_rows] = CPG_SIGNAL[iteration]
+
+        reference.think()
+        controller.update()
+
+        nndf_motor_values = np.array([reference.nn.Get_Value_Of(body_builder.motor_neuron_name(joint_name)) for joint_name in controller.motor_joints])
+        difference = float(np.max(np.abs(nndf_motor_values - controller.motor_values), initial=0.0))
+        assert difference <= tolerance, "compiled controller differs from NEURAL_NETWORK by {} at step {}".format(difference, iteration)
+        largest_difference = max(largest_difference, difference)
+
+        reference.act()
+
+    pblt.disconnect()
+    return largest_difference
+
+
+if __name__ == '__main__':
+    print("largest motor value difference: {}".format(check_nndf_parity()))
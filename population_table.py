@@ -0,0 +1,80 @@
+from __future__ import annotations
+from collections.abc import Mapping
+from typing import Iterator, Union
+import numpy as np
+from solution_ids import solution_id_fields
+
+# A population as columns: one row per solution, with its id and the fields packed into it, its
+# fitness and how long it took to evaluate, next to a list of the Solution objects themselves.
+# It reads like the dict of solution id -> Solution it replaces, while printing, sorting and
+# family counting work on whole columns.
+
+POPULATION_DTYPE = np.dtype([
+    ('solution_id',     np.uint64),
+    ('generation',      np.int64),
+    ('family1',         np.int64),
+    ('family2',         np.int64),
+    ('child',           np.int64),
+    ('fitness',         np.float64),
+    ('evaluation_time', np.float64)
+])
+
+class PopulationTable(Mapping):
+
+    def __init__(self, solutions: Union[Mapping, None] = None) -> None:
+        solutions = solutions if solutions is not None else {}
+        self.solutions = list(solutions.values())
+        self.rows = np.zeros(len(self.solutions), dtype=POPULATION_DTYPE)
+
+        self.rows['solution_id'] = np.fromiter(solutions.keys(), dtype=np.uint64, count=len(self.solutions))
+        self.rows['generation'], self.rows['family1'], self.rows['family2'], self.rows['child'] = solution_id_fields(self.rows['solution_id'])
+        self.rows['fitness'] = [solution.fitness for solution in self.solutions]
+        self.rows['evaluation_time'] = [solution.evaluation_time for solution in self.solutions]
+        self.row_numbers = None
+
+    @classmethod
+    def from_rows(cls, rows: np.ndarray, solutions: list) -> PopulationTable:
+        table = cls.__new__(cls)
+        table.rows = rows
+        table.solutions = solutions
+        table.row_numbers = None
+        return table
+
+    def row_of(self, solution_id: int) -> int:
+        if self.row_numbers is None:
+            self.row_numbers = { solution_id: row for row, solution_id in enumerate(self.rows['solution_id'].tolist()) }
+        return self.row_numbers[solution_id]
+
+    def __getitem__(self, solution_id: int):
+        return self.solutions[self.row_of(solution_id)]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.rows['solution_id'].tolist())
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __or__(self, other: Mapping) -> PopulationTable:
+        # like dict union: where both have an id, other's solution is kept, in other's place
+        other = other if isinstance(other, PopulationTable) else PopulationTable(other)
+        rows = np.concatenate([self.rows, other.rows])
+        solutions = self.solutions + other.solutions
+
+        _, last_rows = np.unique(rows['solution_id'][::-1], return_index=True)
+        if len(last_rows) < len(rows):
+            keep = np.sort(len(rows) - 1 - last_rows)
+            return PopulationTable.from_rows(rows[keep], [solutions[row] for row in keep.tolist()])
+        return PopulationTable.from_rows(rows, solutions)
+
+    def take(self, rows: np.ndarray) -> PopulationTable:
+        return PopulationTable.from_rows(self.rows[rows], [self.solutions[row] for row in np.asarray(rows).tolist()])
+
+    def set_fitness(self, solution_id: int, fitness: float, evaluation_time: float = 0.0) -> None:
+        row = self.row_of(solution_id)
+        self.solutions[row].set_fitness(fitness, evaluation_time)
+        self.rows['fitness'][row] = fitness
+        self.rows['evaluation_time'][row] = evaluation_time
+
+    def fittest_first(self) -> np.ndarray:
+        # rows by fitness, best first; equal fitnesses keep their order in the table
+        return np.argsort(-self.rows['fitness'], kind='stable')
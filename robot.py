@@ -1,21 +1,32 @@
 import numpy as np
 import pybullet as pblt
 from sensor import Sensor
-from motor import Motor
+from motor import Motor, MAX_FORCE
 import pyrosim_z as psz
 from pyrosim_z.neuralNetwork import NEURAL_NETWORK
+from neural_controller import NeuralController
+import body_builder
 import time
 import constants as Cnsts
 
 import os
 
-class Robot:
+CPG_SIGNAL = Cnsts.CPG_magnitude * np.sin(Cnsts.CPG_period_modifier * np.arange(Cnsts.num_iterations))
 
-    def __init__(self, solution_id):
-        self.id = pblt.loadURDF("./data/robot/body{}.urdf".format(solution_id)) #, flags=pblt.URDF_USE_SELF_COLLISION + pblt.URDF_USE_SELF_COLLISION_INCLUDE_PARENT)
+class Robot:
 
+    def __init__(self, solution_id, body=None, weight_matrix=None, base_position=(0, 0, 0), motor_array=True, visual=False):
         self.solution_id = solution_id
 
+        if body is not None:
+            self.build_in_memory(body, weight_matrix, base_position, motor_array, visual)
+            return
+
+        self.controller = None
+        self.collision_shapes = []
+
+        self.id = pblt.loadURDF("./data/robot/body{}.urdf".format(solution_id)) #, flags=pblt.URDF_USE_SELF_COLLISION + pblt.URDF_USE_SELF_COLLISION_INCLUDE_PARENT)
+
         psz.Prepare_To_Simulate(self.id)
 
         self.prepare_to_sense()
@@ -25,6 +36,34 @@ class Robot:
         os.system("rm ./data/robot/brain{}.nndf".format(self.solution_id))
         os.system("rm ./data/robot/body{}.urdf".format(self.solution_id))
 
+    def build_in_memory(self, body, weight_matrix, base_position, motor_array, visual):
+        # no URDF/NNDF round trip: the body goes straight to createMultiBody and the brain
+        # is driven from the weight matrix, so link and joint indices come from the body description
+        # and are kept per body id, which lets several robots share one physics world
+        self.id, self.collision_shapes = body_builder.create_multibody(body, base_position, visual)
+
+        self.link_names_to_indices = { part_name: row - 1 for row, part_name in enumerate(body.part_names) }
+        self.joint_names_to_indices = { joint_name: index for index, joint_name in enumerate(body.joint_names) }
+
+        self.motors = {}
+        for joint_name, joint_index in self.joint_names_to_indices.items():
+            self.motors[joint_name] = Motor(joint_name, joint_index)
+
+        self.controller = NeuralController(weight_matrix, body.joint_names, body.sensor_parts, self.link_names_to_indices, self.joint_names_to_indices)
+        self.motor_columns = [self.motors[joint_name] for joint_name in self.controller.motor_joints]
+
+        # with motor_array every joint target goes out in one setJointMotorControlArray call
+        self.motor_array = motor_array and len(self.motor_columns) > 0
+        self.motor_joint_indices = self.controller.motor_joint_indices.tolist()
+        self.motor_forces = [MAX_FORCE] * len(self.motor_joint_indices)
+
+        # touch is read for the controller's sensor links only, from one contact query per step;
+        # brain rows take the CPG signal instead
+        self.sensors = {}
+        self.touch_lookup = np.full(len(body.part_names) + 1, -1.0)
+        self.sensor_lookup_indices = self.controller.sensor_link_indices + 1
+        self.brain_rows = np.array([row for row, link_name in enumerate(self.controller.sensor_links) if link_name in body.brain_parts], dtype=int)
+
     def prepare_to_sense(self):
         self.sensors = {}
         for link_name in psz.get_link_names_to_indices():
@@ -39,20 +78,53 @@ class Robot:
         self.nn = NEURAL_NETWORK("./data/robot/brain{}.nndf".format(self.solution_id))
 
     def sense(self, iteration):
+        if self.controller is not None:
+            self.sense_touch(iteration)
+            return
+
         for sensor_name in self.sensors:
             self.sensors[sensor_name].get_value(iteration)
             if 'b' in sensor_name:
-                self.nn.neurons[sensor_name].Set_Value(Cnsts.CPG_magnitude * np.sin(Cnsts.CPG_period_modifier * iteration))
+                self.nn.neurons[sensor_name].Set_Value(CPG_SIGNAL[iteration])
+
+    def sense_touch(self, iteration):
+        touched_lookup_indices = [contact_point[3] + 1 for contact_point in pblt.getContactPoints(bodyA=self.id)]
+
+        self.touch_lookup[touched_lookup_indices] = 1.0
+        self.controller.sensor_values[:] = self.touch_lookup[self.sensor_lookup_indices]
+        self.touch_lookup[touched_lookup_indices] = -1.0
+
+        self.controller.sensor_values[self.brain_rows] = CPG_SIGNAL[iteration]
 
     def act(self):
+        if self.controller is not None:
+            self.act_on_joints()
+            return
+
         for neuron_name in self.nn.Get_Neuron_Names():
             if self.nn.Is_Motor_Neuron(neuron_name):
                 joint_name = self.nn.Get_Motor_Neuron_Joint(neuron_name)
                 desired_angle = self.nn.Get_Value_Of(neuron_name)
                 self.motors[joint_name].set_value(self, desired_angle)
 
+    def act_on_joints(self):
+        if self.motor_array:
+            pblt.setJointMotorControlArray(
+                bodyIndex=self.id,
+                jointIndices=self.motor_joint_indices,
+                controlMode=pblt.POSITION_CONTROL,
+                targetPositions=(self.controller.motor_values * Cnsts.motor_joint_range).tolist(),
+                forces=self.motor_forces)
+            return
+
+        for column, motor in enumerate(self.motor_columns):
+            motor.set_value(self, self.controller.motor_values[column])
+
     def think(self):
-        self.nn.Update()
+        if self.controller is not None:
+            self.controller.update()
+        else:
+            self.nn.Update()
 
     def save_sensor_motor_data(self):
         for sensor_name in self.sensors:
@@ -1,10 +1,13 @@
 import argparse
 from faery_pc1mp import FAERYvPyrCor1MP
 from faery_pc1nop import FAERYvPyrCor1NoP
+from faery_pc1async import FAERYvPyrCor1Async
+import checkpoint
 import os
 import matplotlib.pyplot as plt
 import pickle
 import numpy as np
+import constants as Cnsts
 
 from timeit import default_timer as timer
 
@@ -12,21 +15,45 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog = 'search.py',
         description = 'Performs a search for an optimizied neural network weight set for a simulated robot using FAEry Algorithms')
-    parser.add_argument('-m', '--method', choices=['1', '2'], default='1')
+    parser.add_argument('-m', '--method', choices=['1', '2', '3'], default='1', help='1: generational, multiprocessing; 2: generational, single process; 3: steady state, multiprocessing')
     parser.add_argument('-b', '--benchmark', choices=['false', 'true'], default='false')
+    parser.add_argument('-k', '--robots-per-world', type=int, default=Cnsts.robots_per_world)
+    parser.add_argument('-c', '--control-period', type=int, default=Cnsts.control_period)
+    parser.add_argument('-s', '--seed', type=int, default=Cnsts.random_seed)
+    parser.add_argument('--checkpoint', default=Cnsts.checkpoint_file, help='file rewritten every checkpoint_interval generations (method 1), {} standing for the time the run started; "none" turns checkpointing off')
+    parser.add_argument('-r', '--resume', default=None, help='checkpoint to carry on a run from (method 1)')
+    parser.add_argument('-w', '--warm-start', nargs='+', default=None, help='genome files or checkpoints whose genomes seed the first population (methods 1 and 3)')
 
     args = parser.parse_args()
 
+    if args.resume is not None and args.method != '1':
+        parser.error('--resume needs method 1')
+    if args.resume is not None and args.warm_start is not None:
+        parser.error('--resume carries on with the checkpoint\'s parents; it cannot be combined with --warm-start')
+    if args.warm_start is not None and args.method == '2':
+        parser.error('--warm-start needs method 1 or 3')
+
+    checkpoint_file = None if args.checkpoint == 'none' else args.checkpoint
+
     if args.method == '1':
-        evolutionary_algorithm = FAERYvPyrCor1MP()
+        evolutionary_algorithm = FAERYvPyrCor1MP(robots_per_world=args.robots_per_world, control_period=args.control_period, seed=args.seed, checkpoint_file=checkpoint_file)
         benchmark_runs = 20
 
     elif args.method == '2':
         evolutionary_algorithm = FAERYvPyrCor1NoP()
         benchmark_runs = 10
+
+    elif args.method == '3':
+        evolutionary_algorithm = FAERYvPyrCor1Async(control_period=args.control_period, seed=args.seed)
+        benchmark_runs = 20
     else:
         exit()
 
+    if args.resume is not None:
+        evolutionary_algorithm.resume(checkpoint.load_checkpoint(args.resume))
+    if args.warm_start is not None:
+        evolutionary_algorithm.warm_start(checkpoint.load_genomes(args.warm_start))
+
     best_genome_file_name = None
     fitnesses_file_name = None
     
@@ -56,7 +83,7 @@ if __name__ == "__main__":
         print('\nmean execution time: ', np.mean(elapsed_times), ' seconds')
         print('\nstd. dev. execution time: ', np.std(elapsed_times), ' seconds')
 
-    cmd_to_send = 'python simulate_genome.py -f "{}"'.format(best_genome_file_name)
+    cmd_to_send = 'python simulate_genome.py -f "{}" -c {}'.format(best_genome_file_name, args.control_period)
 
     input("Press ENTER to continue to simulation")
 
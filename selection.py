@@ -0,0 +1,76 @@
+from __future__ import annotations
+import numpy as np
+
+# Family-aware truncation selection on fitness and family columns.
+# The rule is the one select has always used: go through the population best first (equal
+# fitnesses in table order), and take anyone whose two families each have at most
+# family_filter_size survivors so far, counting a survivor once for each of its families
+# (twice when family1 == family2), until size are taken.
+# Whether a solution passes only depends on the solutions before it in its own families, so when
+# family1 == family2 it passes exactly when it is among the first family_filter_size // 2 + 1 of
+# its family, and that is worked out for every row at once. Only families linked to others by a
+# solution with two different families are counted one solution at a time.
+# Nothing after a row changes whether it passes, so only the fittest rows are sorted, twice as
+# many as there are places to begin with, and more only if too few of those pass.
+
+def family_ranks(families: np.ndarray) -> np.ndarray:
+    # each entry's position among the entries of its family, counting in the order given
+    ranks = np.empty(len(families), dtype=np.int64)
+    if len(families) == 0:
+        return ranks
+    by_family = np.argsort(families, kind='stable')
+    sorted_families = families[by_family]
+    group_starts = np.flatnonzero(np.r_[True, sorted_families[1:] != sorted_families[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(families)])
+    ranks[by_family] = np.arange(len(families)) - np.repeat(group_starts, group_sizes)
+    return ranks
+
+def fittest_rows(fitness: np.ndarray, count: int) -> np.ndarray:
+    # the count fittest rows best first, equal fitnesses in table order, and any more tied with the last
+    if count >= len(fitness):
+        return np.argsort(-fitness, kind='stable')
+    threshold = np.partition(fitness, len(fitness) - count)[len(fitness) - count]
+    rows = np.flatnonzero(fitness >= threshold)
+    return rows[np.argsort(-fitness[rows], kind='stable')]
+
+def family_quota_passes(family1: np.ndarray, family2: np.ndarray, family_filter_size: int) -> np.ndarray:
+    # family1 and family2 in selection order; whether each one would be taken if size were unlimited
+    passes = np.empty(len(family1), dtype=bool)
+
+    crossed = family1 != family2
+    linked = np.zeros(len(family1), dtype=bool)
+    if crossed.any():
+        linked_families = np.union1d(family1[crossed], family2[crossed])
+        linked = np.isin(family1, linked_families) | np.isin(family2, linked_families)
+
+    single = np.flatnonzero(~linked)
+    passes[single] = 2 * family_ranks(family1[single]) <= family_filter_size
+
+    family_counts = {}
+    linked_rows = np.flatnonzero(linked)
+    for row, first_family, second_family in zip(linked_rows.tolist(), family1[linked_rows].tolist(), family2[linked_rows].tolist()):
+        passes[row] = family_counts.get(first_family, 0) <= family_filter_size and family_counts.get(second_family, 0) <= family_filter_size
+        if passes[row]:
+            family_counts[first_family] = family_counts.get(first_family, 0) + 1
+            family_counts[second_family] = family_counts.get(second_family, 0) + 1
+
+    return passes
+
+def select_survivors(fitness: np.ndarray, family1: np.ndarray, family2: np.ndarray, size: int, family_filter_size: int) -> np.ndarray:
+    # rows of the survivors, best first. If the family limits leave fewer than size, the best of
+    # those turned away make up the difference, so selection always ends with min(size, rows) rows
+    if size <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    candidates = 2 * size
+    while True:
+        fittest_first = fittest_rows(fitness, candidates)
+        passes = family_quota_passes(family1[fittest_first], family2[fittest_first], family_filter_size)
+        if np.count_nonzero(passes) >= size or len(fittest_first) == len(fitness):
+            break
+        candidates *= 2
+
+    survivors = fittest_first[passes][:size]
+    if len(survivors) < size:
+        survivors = np.concatenate([survivors, fittest_first[~passes][:size - len(survivors)]])
+    return survivors
@@ -1,39 +1,47 @@
 from body_builder import *
 from simulation import Simulation
-import pickle
+from solution import brain_random_state
+import genome_format
 import argparse
+import constants as Cnsts
 
 parser = argparse.ArgumentParser(
     prog = 'simulate_genome.py',
     description = 'Simulates the genome saved in a given file.')
 parser.add_argument('-f', '--file')
+parser.add_argument('-e', '--export', action='store_true', help='also write the robot URDF and NNDF files to ./data/robot')
+parser.add_argument('-c', '--control-period', type=int, default=Cnsts.control_period, help='physics steps per controller update')
 
 args = parser.parse_args()
 
-def simulate():
-    simulation = Simulation("GUI", 0)
-    simulation.run()
+def simulate(body, weight_matrix):
+    simulation = Simulation("GUI", 0, body, weight_matrix)
+    simulation.run(control_period=args.control_period)
 
 if __name__ == '__main__':
     fitness_file_name = args.file
 
-    with open(fitness_file_name, "rb") as fp:
-        genome: Genome = pickle.load(fp)
+    genome: Genome = genome_format.load_genome(fitness_file_name)
 
     body_plan = genome.body_chromosome
 
     solution_id = 0
 
-    psz.Start_URDF("./data/robot/body{}.urdf".format(solution_id))
+    body = describe_body(body_plan)
 
-    joint_names, sensor_parts, abstract_centers = build_body(body_plan)
+    weight_matrix = create_brain(body.joint_names, body.sensor_parts, genome.brain_chromosome, brain_random_state(genome))
 
-    psz.end()
+    if args.export:
+        psz.Start_URDF("./data/robot/body{}.urdf".format(solution_id))
 
-    psz.Start_NeuralNetwork("./data/robot/brain{}.nndf".format(solution_id))
+        write_body(body)
 
-    weight_matrix = build_brain(joint_names, sensor_parts)
+        psz.end()
 
-    psz.end()
+        psz.Start_NeuralNetwork("./data/robot/brain{}.nndf".format(solution_id))
 
-    simulate()
\ No newline at end of file
+        write_brain(body.joint_names, body.sensor_parts, weight_matrix)
+
+        psz.end()
+
+    simulate(body, weight_matrix)
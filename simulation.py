@@ -6,8 +6,22 @@ import time
 
 class Simulation:
 
-    def __init__(self, pybullet_method, solution_id):
+    def __init__(self, pybullet_method, solution_id, body=None, weight_matrix=None):
         self.pblt_mthd = pybullet_method
+        self.start_world()
+
+        self.robot = robot.Robot(solution_id, body, weight_matrix, motor_array=self.pblt_mthd == "DIRECT", visual=self.pblt_mthd != "DIRECT")
+
+    def start_world(self):
+        self.owns_client = not (self.pblt_mthd == "DIRECT" and world.shared_world is not None)
+
+        if self.owns_client:
+            self.connect()
+            self.world = world.World()
+        else:
+            self.world = world.shared_world
+
+    def connect(self):
         if self.pblt_mthd == "DIRECT":
             self.physics_client = pblt.connect(pblt.DIRECT)
         elif self.pblt_mthd == "GUI":
@@ -20,21 +34,97 @@ class Simulation:
 
         pblt.setGravity(0, 0, -9.8)
 
-        self.world = world.World()
-        self.robot = robot.Robot(solution_id)
+    def run(self, stop_criteria=(), control_period=c.control_period):
+        # the controller runs once every control_period physics steps; motor targets hold in between
+        self.y_history = []
+        self.steps_run = 0
 
-    def run(self):
         for iteration in range(c.num_iterations):
 
             pblt.stepSimulation()
-            self.robot.sense(iteration)
-            self.robot.act()
-            self.robot.think()
+            if iteration % control_period == 0:
+                self.robot.sense(iteration)
+                self.robot.act()
+                self.robot.think()
+            self.steps_run = iteration + 1
             if self.pblt_mthd != "DIRECT":
                 time.sleep(c.sleep_time)
 
+            if stop_criteria and self.steps_run % c.stop_check_interval == 0 and self.should_stop(self.robot, self.y_history, iteration, stop_criteria):
+                break
+
+    def should_stop(self, robot, y_history, iteration, stop_criteria) -> bool:
+        position, orientation = pblt.getBasePositionAndOrientation(robot.id)
+        y_history.append(position[1])
+        return any(criterion.should_stop(iteration, position, orientation, y_history) for criterion in stop_criteria)
+
     def get_fitness(self) -> float:
         return self.robot.get_fitness()
 
+    def get_steps_run(self) -> int:
+        return self.steps_run
+
+    def collision_shapes(self) -> list[int]:
+        return self.robot.collision_shapes
+
     def __del__(self):
-        pblt.disconnect()
+        if self.owns_client:
+            pblt.disconnect()
+        else:
+            self.world.clear(self.collision_shapes())
+
+class BatchSimulation(Simulation):
+    # several robots stepped together in one physics world, spaced c.robot_spacing apart along x.
+    # Robots only ever touch the ground plane: they are far enough apart not to meet, and each one
+    # senses and acts through its own body id.
+
+    def __init__(self, pybullet_method, solution_ids, bodies, weight_matrices):
+        self.pblt_mthd = pybullet_method
+        self.start_world()
+
+        self.robots = []
+        for index, (solution_id, body, weight_matrix) in enumerate(zip(solution_ids, bodies, weight_matrices)):
+            self.robots.append(robot.Robot(solution_id, body, weight_matrix, base_position=(index * c.robot_spacing, 0, 0), motor_array=self.pblt_mthd == "DIRECT", visual=self.pblt_mthd != "DIRECT"))
+
+    def run(self, stop_criteria=(), control_period=c.control_period):
+        self.y_histories = [[] for robot in self.robots]
+        self.fitnesses = [None] * len(self.robots)
+        self.steps_run = [0] * len(self.robots)
+        active_robots = list(range(len(self.robots)))
+
+        for iteration in range(c.num_iterations):
+
+            pblt.stepSimulation()
+            for index in active_robots:
+                if iteration % control_period == 0:
+                    self.robots[index].sense(iteration)
+                    self.robots[index].act()
+                    self.robots[index].think()
+                self.steps_run[index] = iteration + 1
+            if self.pblt_mthd != "DIRECT":
+                time.sleep(c.sleep_time)
+
+            if stop_criteria and (iteration + 1) % c.stop_check_interval == 0:
+                for index in list(active_robots):
+                    if self.should_stop(self.robots[index], self.y_histories[index], iteration, stop_criteria):
+                        self.retire(index)
+                        active_robots.remove(index)
+                if not active_robots:
+                    break
+
+        for index in active_robots:
+            self.fitnesses[index] = self.robots[index].get_fitness()
+
+    def retire(self, index):
+        # stopped robots leave the world so they no longer cost physics time
+        self.fitnesses[index] = self.robots[index].get_fitness()
+        pblt.removeBody(self.robots[index].id)
+
+    def get_fitnesses(self) -> list[float]:
+        return self.fitnesses
+
+    def get_steps_run(self) -> list[int]:
+        return self.steps_run
+
+    def collision_shapes(self) -> list[int]:
+        return [shape for robot in self.robots for shape in robot.collision_shapes]
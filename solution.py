@@ -4,68 +4,126 @@ import body_builder
 import body_mutator
 import brain_mutator
 from body_parts import *
-import os
 import time
 import constants as Cnsts
 import warnings
-from simulation import Simulation
+from timeit import default_timer as timer
+from typing import NamedTuple
+from fitness_cache import genome_hash
+from simulation import Simulation, BatchSimulation
+
+class EvaluationResult(NamedTuple):
+    # what a pool worker sends back for one simulated genome
+    solution_id:    int
+    fitness:        float
+    steps_run:      int
+    elapsed:        float
+    joint_names:    list[str]
+    sensor_parts:   list[str]
+
+def brain_random_state(genome: Genome) -> np.random.RandomState:
+    # weights a genome does not carry yet are drawn from its own hash, so the worker that evaluates it
+    # and the process that keeps it build the same brain
+    return np.random.RandomState(int(genome_hash(genome), 16) % 2**32)
 
 class Solution:
     
     def __init__(self, solution_id = 0, genome = None) -> None:
         self.solution_id = solution_id
+        self.fitness = Cnsts.default_fitness
+        self.evaluation_time = 0.0
 
         self.genome = genome
         if self.genome is None:
             self.genome = Genome(body_mutator.BASE_BODYCONS_ID , None, body_mutator.BASE_BODYPLAN)
+            self.mutate_body()
 
         self.mutation_rate = Cnsts.mutation_rate
         self.mutation_magnitude = Cnsts.mutation_magnitude
 
-    def start_simulation(self, pybullet_method = "DIRECT") -> None:
-        self.generate_body()
-        self.generate_brain()
-        simulation = Simulation(pybullet_method, self.solution_id)
-        simulation.run()
+    def start_simulation(self, pybullet_method = "DIRECT", export_files = Cnsts.export_robot_files, stop_criteria = (), control_period = Cnsts.control_period) -> None:
+        self.generate_body(export_files)
+        self.generate_brain(export_files)
+        simulation = Simulation(pybullet_method, self.solution_id, self.body, self.weight_matrix)
+        simulation.run(stop_criteria, control_period)
+        self.steps_run = simulation.get_steps_run()
         return simulation.get_fitness()
     
-    def set_fitness(self, fitness):
+    def set_fitness(self, fitness, evaluation_time = 0.0):
         self.fitness = fitness
+        self.evaluation_time = evaluation_time
 
-    def generate_body(self) -> None:
-        running = True
-
-        joint_names = []
-        sensor_parts = []
-
-        while running:
-            try:
+    def mutate_body(self) -> None:
+        mutated_body_plan, mutated_bodycons_id = body_mutator.mutate(self.genome.body_chromosome, self.genome.bodycons_id)
 
-                mutated_body_plan, mutated_bodycons_id = body_mutator.mutate(self.genome.body_chromosome, self.genome.bodycons_id)
+        self.genome = Genome(mutated_bodycons_id, self.genome.brain_chromosome, mutated_body_plan)
 
-                psz.Start_URDF("./data/robot/body{}.urdf".format(self.solution_id))
+    def generate_body(self, export_files = False) -> None:
+        body = body_builder.describe_body(self.genome.body_chromosome)
 
-                joint_names, sensor_parts, abstract_centers = body_builder.build_body(mutated_body_plan)
+        if export_files:
+            psz.Start_URDF("./data/robot/body{}.urdf".format(self.solution_id))
 
-                psz.end()
+            body_builder.write_body(body)
 
-                self.genome = Genome(mutated_bodycons_id, self.genome.brain_chromosome, mutated_body_plan)
+            psz.end()
 
-                running = False
+        self.body = body
+        self.joint_names = body.joint_names
+        self.sensor_parts = body.sensor_parts
 
-            except:
-                psz.end()
-                os.system("rm ./data/robot/body{}.urdf".format(self.solution_id))
-                
-        self.joint_names = joint_names
-        self.sensor_parts = sensor_parts
+    def generate_brain(self, export_files = False) -> None:
+        weight_matrix = body_builder.create_brain(self.joint_names, self.sensor_parts, self.genome.brain_chromosome, brain_random_state(self.genome))
 
-    def generate_brain(self) -> None:
-        psz.Start_NeuralNetwork("./data/robot/brain{}.nndf".format(self.solution_id))
+        if export_files:
+            psz.Start_NeuralNetwork("./data/robot/brain{}.nndf".format(self.solution_id))
 
-        weight_matrix = body_builder.build_brain(self.joint_names, self.sensor_parts)
+            body_builder.write_brain(self.joint_names, self.sensor_parts, weight_matrix)
 
-        psz.end()
+            psz.end()
 
         self.weight_matrix = weight_matrix
         self.genome = Genome(self.genome.bodycons_id, self.weight_matrix, self.genome.body_chromosome)
+
+    def rebuild_brain(self, joint_names = None, sensor_parts = None) -> None:
+        # puts the brain a worker evaluated into this genome, from the joint and sensor lists it sent back
+        # (or from compiling the body here when there are none, e.g. for fitnesses that came from the cache)
+        if joint_names is None:
+            body = body_builder.describe_body(self.genome.body_chromosome)
+            joint_names, sensor_parts = body.joint_names, body.sensor_parts
+
+        self.joint_names = joint_names
+        self.sensor_parts = sensor_parts
+        self.generate_brain()
+
+def evaluate_genome(solution_id, genome, stop_criteria = (), control_period = Cnsts.control_period) -> EvaluationResult:
+    start_time = timer()
+    solution = Solution(solution_id, genome)
+    fitness = solution.start_simulation(stop_criteria=stop_criteria, control_period=control_period)
+    return EvaluationResult(solution_id, fitness, solution.steps_run, timer() - start_time, solution.joint_names, solution.sensor_parts)
+
+def evaluate_genomes(solution_ids, genomes, stop_criteria = (), control_period = Cnsts.control_period) -> list[EvaluationResult]:
+    # one physics world for the whole batch, so each robot is charged an equal share of its time
+    start_time = timer()
+    solutions = [Solution(solution_id, genome) for solution_id, genome in zip(solution_ids, genomes)]
+    fitnesses = simulate_solutions(solutions, stop_criteria=stop_criteria, control_period=control_period)
+    elapsed = (timer() - start_time) / len(solutions)
+    return [EvaluationResult(solution.solution_id, fitness, solution.steps_run, elapsed, solution.joint_names, solution.sensor_parts) for solution, fitness in zip(solutions, fitnesses)]
+
+def simulate_solutions(solutions, pybullet_method = "DIRECT", stop_criteria = (), control_period = Cnsts.control_period) -> list[float]:
+    # evaluates several solutions side by side in one physics world
+    for solution in solutions:
+        solution.generate_body()
+        solution.generate_brain()
+
+    simulation = BatchSimulation(
+        pybullet_method,
+        [solution.solution_id for solution in solutions],
+        [solution.body for solution in solutions],
+        [solution.weight_matrix for solution in solutions])
+    simulation.run(stop_criteria, control_period)
+
+    for solution, steps_run in zip(solutions, simulation.get_steps_run()):
+        solution.steps_run = steps_run
+
+    return simulation.get_fitnesses()
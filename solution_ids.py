@@ -0,0 +1,53 @@
+from __future__ import annotations
+from typing import NamedTuple, Union
+import numpy as np
+
+# Solution ids are integers packed from the generation a solution was made in, its two families
+# and its index among the children its family had that generation:
+#   generation (16 bits) | family1 (20 bits) | family2 (20 bits) | child (8 bits)
+# so they sort by generation, fit a uint64 column, and unpack with shifts, one at a time or as arrays.
+
+GENERATION_BITS = 16
+FAMILY_BITS = 20
+CHILD_BITS = 8
+
+CHILD_SHIFT = 0
+FAMILY2_SHIFT = CHILD_SHIFT + CHILD_BITS
+FAMILY1_SHIFT = FAMILY2_SHIFT + FAMILY_BITS
+GENERATION_SHIFT = FAMILY1_SHIFT + FAMILY_BITS
+
+class SolutionIdFields(NamedTuple):
+    generation: int
+    family1:    int
+    family2:    int
+    child:      int
+
+def pack_solution_id(generation: int, family1: int, family2: int, child: int) -> int:
+    for name, value, bits in (('generation', generation, GENERATION_BITS), ('family1', family1, FAMILY_BITS), ('family2', family2, FAMILY_BITS), ('child', child, CHILD_BITS)):
+        if not 0 <= value < 1 << bits:
+            raise ValueError("{} {} does not fit the {} bits solution ids keep for it".format(name, value, bits))
+    return (generation << GENERATION_SHIFT) | (family1 << FAMILY1_SHIFT) | (family2 << FAMILY2_SHIFT) | (child << CHILD_SHIFT)
+
+def unpack_solution_id(solution_id: int) -> SolutionIdFields:
+    return SolutionIdFields(*(int(field) for field in solution_id_fields(np.uint64(solution_id))))
+
+def solution_id_fields(solution_ids: Union[np.ndarray, np.uint64]) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # generation, family1, family2 and child of every id in solution_ids
+    solution_ids = np.asarray(solution_ids, dtype=np.uint64)
+
+    def field(shift, bits):
+        return ((solution_ids >> np.uint64(shift)) & np.uint64((1 << bits) - 1)).astype(np.int64)
+
+    return field(GENERATION_SHIFT, GENERATION_BITS), field(FAMILY1_SHIFT, FAMILY_BITS), field(FAMILY2_SHIFT, FAMILY_BITS), field(CHILD_SHIFT, CHILD_BITS)
+
+def family_of(solution_id: int) -> int:
+    return (solution_id >> FAMILY1_SHIFT) & ((1 << FAMILY_BITS) - 1)
+
+def format_solution_id(solution_id: int) -> str:
+    return "{}.{}.{}.{}".format(*unpack_solution_id(solution_id))
+
+def parse_solution_id(text: str) -> int:
+    # "generation.family1.family2.child", as format_solution_id writes them, or the packed integer
+    if "." in text:
+        return pack_solution_id(*(int(field) for field in text.split(".")))
+    return int(text)
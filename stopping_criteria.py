@@ -0,0 +1,65 @@
+import pybullet as pblt
+import constants as Cnsts
+
+
+# Early-stop predicates for Simulation.run. Every c.stop_check_interval steps the simulation reads
+# the robot's base position and orientation once and asks each criterion whether to stop. Criteria
+# hold only their settings; the per-run history of base y positions lives in the simulation, so one
+# list of criteria can be shared between many simulations and pool tasks.
+
+class StopCriterion:
+
+    def should_stop(self, iteration, position, orientation, y_history) -> bool:
+        return False
+
+class StallCriterion(StopCriterion):
+    # no y-progress over the last `window` steps
+
+    def __init__(self, window=Cnsts.stall_window, min_progress=Cnsts.stall_min_progress):
+        self.checks_per_window = max(1, window // Cnsts.stop_check_interval)
+        self.min_progress = min_progress
+
+    def should_stop(self, iteration, position, orientation, y_history) -> bool:
+        if len(y_history) <= self.checks_per_window:
+            return False
+        return abs(y_history[-1] - y_history[-1 - self.checks_per_window]) < self.min_progress
+
+class FallCriterion(StopCriterion):
+    # base dropped under a height threshold
+
+    def __init__(self, min_height=Cnsts.min_base_height):
+        self.min_height = min_height
+
+    def should_stop(self, iteration, position, orientation, y_history) -> bool:
+        return position[2] < self.min_height
+
+class FlipCriterion(StopCriterion):
+    # base's up axis turned away from world up
+
+    def __init__(self, min_uprightness=Cnsts.min_base_uprightness):
+        self.min_uprightness = min_uprightness
+
+    def should_stop(self, iteration, position, orientation, y_history) -> bool:
+        up_z = pblt.getMatrixFromQuaternion(orientation)[8]
+        return up_z < self.min_uprightness
+
+class BoundCriterion(StopCriterion):
+    # even moving at the best plausible speed for the remaining steps cannot reach the cutoff
+
+    def __init__(self, cutoff_fitness, max_progress_per_step=Cnsts.max_progress_per_step):
+        self.cutoff_fitness = cutoff_fitness
+        self.max_progress_per_step = max_progress_per_step
+
+    def should_stop(self, iteration, position, orientation, y_history) -> bool:
+        remaining_steps = Cnsts.num_iterations - iteration - 1
+        return position[1] + self.max_progress_per_step * remaining_steps < self.cutoff_fitness
+
+def default_stop_criteria(cutoff_fitness=None) -> list[StopCriterion]:
+    criteria = [StallCriterion()]
+    if Cnsts.min_base_height is not None:
+        criteria.append(FallCriterion())
+    if Cnsts.min_base_uprightness is not None:
+        criteria.append(FlipCriterion())
+    if cutoff_fitness is not None:
+        criteria.append(BoundCriterion(cutoff_fitness))
+    return criteria
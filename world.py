@@ -1,6 +1,27 @@
 import pybullet as pblt
+import pybullet_data
+
+shared_world = None
 
 class World:
 
     def __init__(self):
-        self.plane_id = pblt.loadURDF("plane.urdf")
\ No newline at end of file
+        self.plane_id = pblt.loadURDF("plane.urdf")
+
+    def clear(self, collision_shapes=()):
+        # removes everything but the ground plane so the physics client can be reused, and the
+        # collision shapes bodies built in memory were made from, which removeBody leaves behind
+        body_ids = [pblt.getBodyUniqueId(index) for index in range(pblt.getNumBodies())]
+        for body_id in body_ids:
+            if body_id != self.plane_id:
+                pblt.removeBody(body_id)
+        for collision_shape in collision_shapes:
+            pblt.removeCollisionShape(collision_shape)
+
+def start_shared_world():
+    # pool initializer: every worker keeps one DIRECT client and ground plane for its whole life
+    global shared_world
+    pblt.connect(pblt.DIRECT)
+    pblt.setAdditionalSearchPath(pybullet_data.getDataPath())
+    pblt.setGravity(0, 0, -9.8)
+    shared_world = World()